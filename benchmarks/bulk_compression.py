@@ -0,0 +1,95 @@
+"""
+Bulk load through a plain and a compressed connection against a local
+stand-in for elasticsearch whose link is throttled to ``--mbps``.
+
+    python benchmarks/bulk_compression.py --docs 50000 --mbps 100
+"""
+import argparse
+import gzip
+import io
+import json
+import threading
+import time
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+
+from elasticsearch_dsl.connections import connections
+from elasticsearch_dsl.queue import Queue
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    mbps = 100
+    received = 0
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['content-length']))
+        # the time it would take on the wire
+        time.sleep(len(body) * 8 / (self.server.mbps * 1e6))
+        self.server.received += len(body)
+        if self.headers.get('content-encoding') == 'gzip':
+            body = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+        items = [{'index': {'status': 201}}] * (body.count(b'\n') // 2)
+        response = json.dumps({'took': 1, 'errors': False, 'items': items}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class Doc(object):
+    def __init__(self, id):
+        self.id = id
+
+    def to_es(self):
+        return {'_id': self.id, '_type': 'event', '_source': {
+            'host': 'web-%02d.example.com' % (self.id % 20),
+            'message': 'GET /api/v1/items/%d HTTP/1.1 200' % self.id,
+            'tags': ['production', 'frontend', 'http'],
+            'timestamp': '2015-02-01T12:%02d:%02d' % (self.id // 60 % 60, self.id % 60),
+        }}
+
+
+def run(alias, docs, compact):
+    queue = Queue(using=alias, max_docs=1000, flush_interval=60, concurrency=2, compact=compact)
+    start = time.time()
+    for i in range(docs):
+        queue.append(Doc(i), 'events')
+    queue.close()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--docs', type=int, default=50000)
+    parser.add_argument('--mbps', type=float, default=100)
+    parser.add_argument('--compact', action='store_true')
+    args = parser.parse_args()
+
+    server = Server(('127.0.0.1', 0), Handler)
+    server.mbps = args.mbps
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    host = {'host': '127.0.0.1', 'port': server.server_address[1]}
+    connections.configure(plain={'hosts': [host]}, gzip={'hosts': [host], 'compress': True})
+
+    for alias in ('plain', 'gzip'):
+        server.received = 0
+        took = run(alias, args.docs, args.compact)
+        print('%-6s %8.2fs %10.0f docs/s %10.1f MB sent' % (
+            alias, took, args.docs / took, server.received / 1e6))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Hydrate (``from_es``), serialize (``to_dict``) and validate documents with
+the generated per class methods and with the generic ones.
+
+    python benchmarks/document_fast_paths.py --docs 100000
+"""
+import argparse
+import time
+
+from elasticsearch_dsl.document import Document
+from elasticsearch_dsl.fields import BooleanField, FloatField, IntField, ListField, StringField
+
+
+class Event(Document):
+    host = StringField()
+    message = StringField()
+    service = StringField()
+    level = StringField()
+    status = IntField()
+    bytes = IntField()
+    duration = FloatField()
+    cached = BooleanField()
+    tags = ListField()
+
+    meta = {'index': 'events'}
+
+
+class GenericEvent(Event):
+    pass
+
+
+# undo the specialization
+for method in ('__init__', 'to_dict', 'validate'):
+    setattr(GenericEvent, method, getattr(GenericEvent, method).__func__.generic)
+
+
+def hits(docs):
+    for i in range(docs):
+        yield {'_index': 'events', '_type': 'event', '_id': str(i), '_source': {
+            'host': 'web-%02d.example.com' % (i % 20),
+            'message': 'GET /api/v1/items/%d HTTP/1.1' % i,
+            'service': 'frontend',
+            'level': 'info',
+            'status': 200,
+            'bytes': 512 + i % 1024,
+            'duration': 0.25,
+            'cached': bool(i % 2),
+            'tags': ['production', 'http'],
+        }}
+
+
+def run(cls, hit_list):
+    timings = {}
+    start = time.time()
+    docs = [cls.from_es(hit) for hit in hit_list]
+    timings['from_es'] = time.time() - start
+    start = time.time()
+    for doc in docs:
+        doc.to_dict()
+    timings['to_dict'] = time.time() - start
+    start = time.time()
+    for doc in docs:
+        doc.validate()
+    timings['validate'] = time.time() - start
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--docs', type=int, default=100000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    hit_list = list(hits(args.docs))
+    results = {}
+    for name, cls in (('generic', GenericEvent), ('generated', Event)):
+        rounds = [run(cls, hit_list) for _ in range(args.rounds)]
+        results[name] = dict((step, min(r[step] for r in rounds)) for step in rounds[0])
+
+    print('%-10s %10s %10s %8s' % ('', 'generic', 'generated', 'speedup'))
+    for step in ('from_es', 'to_dict', 'validate'):
+        generic, generated = results['generic'][step], results['generated'][step]
+        print('%-10s %9.3fs %9.3fs %7.2fx' % (step, generic, generated, generic / generated))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@ from .function import SF
 from .search import Search
 from .fields import *
 from .document import Document, BaseDocument
+from .session import Session
 from .mapping import Mapping
 
 VERSION = (0, 0, 4, 'dev')
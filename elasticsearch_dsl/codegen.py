@@ -0,0 +1,137 @@
+from elasticsearch_dsl.exceptions import ValidationError
+from elasticsearch_dsl.fields import META_FIELDS
+from elasticsearch_dsl.result import ResultMeta
+
+__filename__ = 'codegen'
+
+# compiled code of the generated methods, by source, classes declaring the
+# same fields share it
+_code_cache = {}
+
+_TEMPLATE = '''
+def __init__(self, id=None, **kwargs):
+    if self.__class__ is not _cls:
+        return _generic_init(self, id, **kwargs)
+%(state)s
+    get = kwargs.get
+%(init)s
+    meta = {'id': id}
+    for k in kwargs:
+        if k[:1] == '_' and k[1:] in META_FIELDS:
+            meta[k] = kwargs[k]
+    _set_meta(self, ResultMeta(meta))
+
+def to_dict(self):
+    if self.__class__ is not _cls or self._lazy:
+        return _generic_to_dict(self)
+    try:
+        %(values)s
+    except AttributeError:
+        return _generic_to_dict(self)
+    data = {
+%(to_dict)s
+    }
+    if self._extra:
+        data.update(self._extra)
+    return data
+
+def validate(self, names=None):
+    if self.__class__ is not _cls or names is not None:
+        return _generic_validate(self, names)
+    try:
+        %(values)s
+    except AttributeError:
+        return _generic_validate(self)
+    errors = []
+%(validate)s
+    if errors:
+        raise ValidationError('; '.join(errors))
+'''
+
+_STATE = '''    _set%(name)s(self, %(value)r)'''
+_INIT = '''    _set_%(i)d(self, _to_python_%(i)d(get(%(name)r, _default_%(i)d)))'''
+_TO_DICT = '''        %(name)r: _to_python_%(i)d(v%(i)d),'''
+_VALIDATE = '''    try:
+        _validate_%(i)d(v%(i)d)
+    except ValidationError as e:
+        errors.append('{} {}'.format(%(name)r, e.message))'''
+
+
+# generated methods and the name of the generic one they fall back to
+_GENERIC = {
+    '__init__': '_generic_init',
+    'to_dict': '_generic_to_dict',
+    'validate': '_generic_validate',
+}
+
+
+def generic(func):
+    """
+    Mark ``func`` as the generic implementation ``specialize`` may replace
+    on document classes.
+    """
+    func.generic = func
+    return func
+
+
+def _source(names, slot_prefix, state_slots):
+    lines = dict(init=[], to_dict=[], validate=[])
+    for i, name in enumerate(names):
+        for key, template in (('init', _INIT), ('to_dict', _TO_DICT), ('validate', _VALIDATE)):
+            lines[key].append(template % {'i': i, 'name': name})
+    values = ', '.join('v%d' % i for i in range(len(names)))
+    slots = ', '.join('self.%s%s' % (slot_prefix, name) for name in names)
+    return _TEMPLATE % dict(
+        state='\n'.join(_STATE % {'name': name, 'value': value} for name, value in state_slots),
+        init='\n'.join(lines['init']) or '    pass',
+        to_dict='\n'.join(lines['to_dict']),
+        validate='\n'.join(lines['validate']),
+        # unpacking doesn't work with a single value, nor without any
+        values='%s = %s' % (values + ',', slots + ',') if names else 'pass')
+
+
+def specialize(cls, slot_prefix, state_slots=()):
+    """
+    Compile ``__init__`` (which ``from_es`` goes through), ``to_dict`` and
+    ``validate`` for the fields of ``cls``, reading and writing their slots
+    directly and calling each field's ``to_python`` and ``validate`` as
+    locals; ``__init__`` also sets the ``state_slots``, ``(name, value)``
+    pairs. A method is only replaced where ``cls`` would inherit the
+    generic (or a generated) implementation, never an override; instances
+    of subclasses reaching the generated one, and lazily hydrated ones with
+    fields not converted yet, fall back to the generic.
+    """
+    names = list(cls._fields)
+    source = _source(names, slot_prefix, state_slots)
+    code = _code_cache.get(source)
+    if code is None:
+        code = _code_cache[source] = compile(source, '<%s fast paths>' % cls.__name__, 'exec')
+
+    namespace = {
+        '_cls': cls,
+        '_set_meta': cls._meta.__set__,
+        'META_FIELDS': META_FIELDS,
+        'ResultMeta': ResultMeta,
+        'ValidationError': ValidationError,
+    }
+    for name, _ in state_slots:
+        namespace['_set' + name] = getattr(cls, name).__set__
+    for i, name in enumerate(names):
+        field = cls._fields[name]
+        namespace['_set_%d' % i] = getattr(cls, slot_prefix + name).__set__
+        namespace['_to_python_%d' % i] = field.to_python
+        namespace['_validate_%d' % i] = field.validate
+        namespace['_default_%d' % i] = field.default
+
+    replaced = {}
+    for method, generic_name in _GENERIC.items():
+        owner = next(k for k in cls.__mro__ if method in k.__dict__)
+        current = owner.__dict__[method]
+        if owner is not cls and hasattr(current, 'generic'):
+            replaced[method] = namespace[generic_name] = current.generic
+    exec(code, namespace)
+
+    for method, generic_impl in replaced.items():
+        func = namespace[method]
+        func.generic = generic_impl
+        setattr(cls, method, func)
@@ -1,6 +1,174 @@
-from six import string_types
+import threading
+import time
+import zlib
+
+import urllib3
+from six import string_types, text_type
+
+from elasticsearch import Elasticsearch, Urllib3HttpConnection
+from elasticsearch.serializer import JSONSerializer
+
+try:
+    # python 2's zlib doesn't take memoryviews
+    _view = buffer
+except NameError:
+    def _view(data, offset, size):
+        return memoryview(data)[offset:offset + size]
+
+
+def gzip_body(body, level=6, chunk_size=64 * 1024):
+    """
+    Gzip ``body`` (text, bytes or a ``bytearray``) ``chunk_size`` bytes at a
+    time, without copying it first.
+    """
+    if isinstance(body, text_type):
+        body = body.encode('utf-8')
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    chunks = [compressor.compress(_view(body, offset, chunk_size))
+              for offset in range(0, len(body), chunk_size)]
+    chunks.append(compressor.flush())
+    return b''.join(chunks)
+
+
+class BufferSerializer(JSONSerializer):
+    """
+    ``JSONSerializer`` also letting ``bytes`` and ``bytearray`` through as
+    they are, so that an encoded bulk body can be sent without a copy.
+    """
+    def dumps(self, data):
+        if isinstance(data, (bytes, bytearray)):
+            return data
+        return super(BufferSerializer, self).dumps(data)
+
+
+class CompressedConnection(Urllib3HttpConnection):
+    """
+    Connection sending request bodies of ``compress_min_size`` bytes or more
+    gzipped (``Content-Encoding: gzip``) and accepting compressed responses.
+    """
+    def __init__(self, compress_min_size=1024, compress_level=6, **kwargs):
+        self._request = threading.local()
+        super(CompressedConnection, self).__init__(**kwargs)
+        self.compress_min_size = compress_min_size
+        self.compress_level = compress_level
+        self.headers.update(urllib3.make_headers(accept_encoding=True))
+
+    @property
+    def headers(self):
+        # the headers of the request being sent by this thread, if it's compressed
+        return getattr(self._request, 'headers', None) or self._headers
+
+    @headers.setter
+    def headers(self, headers):
+        self._headers = headers
+
+    def perform_request(self, method, url, params=None, body=None, timeout=None, ignore=()):
+        if body is None or len(body) < self.compress_min_size:
+            return super(CompressedConnection, self).perform_request(method, url, params, body, timeout, ignore)
+        # Urllib3HttpConnection sends self.headers and logs the body it is
+        # given, have it send the gzipped one and log the original
+        self._request.headers = dict(self._headers, **{'content-encoding': 'gzip'})
+        self._request.body = body
+        try:
+            return super(CompressedConnection, self).perform_request(
+                method, url, params, gzip_body(body, self.compress_level), timeout, ignore)
+        finally:
+            del self._request.headers, self._request.body
+
+    def log_request_success(self, method, full_url, path, body, *args):
+        body = getattr(self._request, 'body', body)
+        super(CompressedConnection, self).log_request_success(method, full_url, path, body, *args)
+
+    def log_request_fail(self, method, full_url, body, *args, **kwargs):
+        body = getattr(self._request, 'body', body)
+        super(CompressedConnection, self).log_request_fail(method, full_url, body, *args, **kwargs)
+
+
+def _client(compress=False, **kwargs):
+    kwargs.setdefault('serializer', BufferSerializer())
+    if compress:
+        kwargs.setdefault('connection_class', CompressedConnection)
+        # a connection_class of the user's own may not take compress_min_size
+        if compress is not True and issubclass(kwargs['connection_class'], CompressedConnection):
+            kwargs['compress_min_size'] = compress
+    return Elasticsearch(**kwargs)
+
+class _Refresh(object):
+    """
+    One refresh call and its outcome, shared by everyone waiting on it.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class RefreshCoordinator(object):
+    """
+    Merge concurrent ``indices.refresh`` calls for the same index (and
+    connection) into one: a caller joins the refresh waiting to start, if
+    any, or waits for the one in flight to finish and starts the next, so
+    the refresh it gets back always started after it asked. Refreshes of an
+    index start at least ``min_interval`` seconds apart.
+    """
+    def __init__(self, connections, min_interval=0.0):
+        self._connections = connections
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        # (using, index) -> refresh in flight, refresh waiting to start, time the last one started
+        self._running = {}
+        self._waiting = {}
+        self._started = {}
+
+    def refresh(self, index, using='default'):
+        if not isinstance(index, string_types):
+            index = ','.join(index)
+        key = (using, index)
+        with self._lock:
+            call = self._waiting.get(key)
+            leader = call is None
+            if leader:
+                call = self._waiting[key] = _Refresh()
+
+        if leader:
+            self._start(key, call)
+            try:
+                call.response = self._connections.get_connection(using).indices.refresh(index=index)
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._running[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.response
+
+    def _start(self, key, call):
+        # wait for the refresh in flight and for min_interval to pass
+        while True:
+            with self._lock:
+                running = self._running.get(key)
+                if running is None:
+                    now = time.time()
+                    delay = self._started.get(key, 0) + self.min_interval - now
+                    if delay <= 0:
+                        del self._waiting[key]
+                        self._running[key] = call
+                        # forget the indices free to be refreshed again
+                        for k, started in list(self._started.items()):
+                            if started + self.min_interval <= now:
+                                del self._started[k]
+                        self._started[key] = now
+                        return
+            if running is not None:
+                running.done.wait()
+            else:
+                time.sleep(delay)
 
-from elasticsearch import Elasticsearch
 
 class Connections(object):
     """
@@ -10,6 +178,7 @@ class Connections(object):
     def __init__(self):
         self._kwargs = {}
         self._conns = {}
+        self.refresher = RefreshCoordinator(self)
 
     def configure(self, **kwargs):
         """
@@ -26,6 +195,10 @@ class Connections(object):
 
         Connections will only be constructed lazily when requested through
         ``get_connection``.
+
+        ``compress`` in a connection's options (``True`` or the minimal body
+        size in bytes, 1024 by default) makes it gzip request bodies and
+        accept compressed responses.
         """
         for k in list(self._conns):
             # try and preserve existing client to keep the persistent connections alive
@@ -60,9 +233,17 @@ class Connections(object):
         Construct an instance of ``elasticsearch.Elasticsearch`` and register
         it under given alias.
         """
-        conn = self._conns[alias] = Elasticsearch(**kwargs)
+        conn = self._conns[alias] = _client(**kwargs)
         return conn
 
+    def refresh(self, index, using='default'):
+        """
+        Refresh ``index`` through the ``refresher``, merged with any other
+        refresh of it requested at the same time. ``refresher.min_interval``
+        sets the minimal time between two refreshes of an index.
+        """
+        return self.refresher.refresh(index, using)
+
     def get_connection(self, alias='default'):
         """
         Retrieve a connection, construct it if necessary (only configuration
@@ -85,7 +266,7 @@ class Connections(object):
 
         # if not, try to create it
         try:
-            conn = self._conns[alias] = Elasticsearch(**self._kwargs[alias])
+            conn = self._conns[alias] = _client(**self._kwargs[alias])
         except KeyError:
             # no connection and no kwargs to set one up
             raise KeyError('There is no connection with alias %r.' % alias)
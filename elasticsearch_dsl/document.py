@@ -1,29 +1,104 @@
-from six import add_metaclass
+import logging
+import os
+import threading
+
+from elasticsearch import NotFoundError
+from six import add_metaclass, string_types
 from elasticsearch_dsl.result import ResultMeta
 from elasticsearch_dsl.utils import _count_index, _delete_document, _get_document, _save_document, _drop_index, \
-    _make_doc_type_from_name
+    _make_doc_type_from_name, _update_document
 
 from .search import Search
 from .mapping import Mapping
-from .fields import BaseField, DOC_META_FIELDS, META_FIELDS, FULL_META_FIELDS
+from .fields import BaseField, StringField, DOC_META_FIELDS, META_FIELDS
 from .connections import connections
 from .exceptions import ValidationError, ReadOnlyException
 from .queue import Queue
+from .load import load_file
+from .session import current_session
+from .hashing import HASH_FIELD, LRUHashCache, DiskHashCache, content_hash, hash_key
+from .overlay import Overlay
+from .codegen import generic, specialize
+
+SAVE_OPS = ('index', 'create', 'update', 'upsert')
+
+# instance slot holding the value of a declared field
+SLOT_PREFIX = '_f_'
+
+_object_setattr = object.__setattr__
+
+# slots of a document besides ``_meta`` and its fields, with the value they
+# start with, see ``BaseDocument``
+STATE_SLOTS = (
+    ('_extra', None),
+    ('_lazy', None),
+    ('_deferred', None),
+    ('_changed', None),
+    ('_status', None),
+    ('_error', None),
+    ('_hash', None),
+    ('_overlay_entry', None),
+    ('_written_changes', False),
+)
+
+logger = logging.getLogger('elasticsearch_dsl.document')
+
+_context = threading.local()
+
+
+def _bulk_context(doc_class):
+    """
+    Return the innermost ``BulkInsert`` active in the current thread for
+    ``doc_class`` (or one of its parents).
+    """
+    for bulk in reversed(getattr(_context, 'bulk', ())):
+        if issubclass(doc_class, bulk.doc_class):
+            return bulk
+
 
 class BulkInsert(object):
-    def __init__(self, cls, index=None):
+    """
+    Queue every ``save`` and ``delete`` of ``cls`` made in the current thread
+    into a private ``Queue`` targeting ``index`` (the class index by default)
+    and flush it on exit. Nothing is changed on the class itself, so other
+    threads keep saving as usual and can run their own ``BulkInsert``
+    against different indices at the same time.
+
+    With ``refresh=True`` ``index`` is refreshed (through
+    ``connections.refresh``) once everything has been flushed.
+
+    The queue only exists between entering and leaving the block. When the
+    block raises, what was queued is still flushed but a failure to do so
+    is only logged, the original exception goes on.
+    """
+    def __init__(self, cls, index=None, refresh=False, **kwargs):
         self.doc_class = cls
-        self.prev_index = self.doc_class._d.index
-        self.doc_class._d.index = index or self.prev_index
-        self.index = self.doc_class._d.index
+        self.index = index or cls._d.index
+        self.refresh = refresh
+        # the class queue owns the spill directory, don't share it
+        kwargs.setdefault('spill_dir', None)
+        self.queue_options = kwargs
+        self.queue = None
 
     def __enter__(self):
-        self.doc_class._d._bulk = True
+        self.queue = self.doc_class._d.make_queue(index=self.index, **self.queue_options)
+        if not hasattr(_context, 'bulk'):
+            _context.bulk = []
+        _context.bulk.append(self)
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.doc_class._d._bulk = False
-        self.doc_class._d.index = self.prev_index
-        self.doc_class._queue._send(self.index)
+        _context.bulk.remove(self)
+        queue, self.queue = self.queue, None
+        if exc_type is None:
+            queue.close()
+            if self.refresh:
+                connections.refresh(self.index, using=queue.using)
+            return
+        try:
+            queue.close()
+        except Exception:
+            logger.exception('Failed to flush the bulk insert into %r.', self.index)
 
 
 class DocMapping(object):
@@ -33,7 +108,23 @@ class DocMapping(object):
         self._using = meta.get('using', None)
         self._bulk = meta.get('bulk', None)
         self._bulk_size = meta.get('bulk_size', None)
+        self._bulk_bytes = meta.get('bulk_bytes', None)
+        self._bulk_concurrency = meta.get('bulk_concurrency', None)
+        self._bulk_adaptive = meta.get('bulk_adaptive', None)
+        self._bulk_spill_dir = meta.get('bulk_spill_dir', None)
+        self._bulk_spill_threshold = meta.get('bulk_spill_threshold', None)
+        self._bulk_compact = meta.get('bulk_compact', False)
+        self._bulk_callback = meta.get('bulk_callback', None)
+        self._bulk_coalesce = meta.get('bulk_coalesce', False)
+        self._flush_interval = meta.get('flush_interval', None)
+        self._max_pending = meta.get('max_pending', None)
         self._read_only = meta.get('read_only', False)
+        self.routing_field = meta.get('routing_field', None)
+        self.lazy = meta.get('lazy', False)
+        self.hash_cache = self._make_hash_cache(meta.get('content_hash', None))
+        self.overlay = meta.get('read_your_writes', None)
+        if self.overlay is True:
+            self.overlay = Overlay()
         doc_type = meta.get('doc_type', _make_doc_type_from_name(name))
         self.mapping = meta.get('mapping', Mapping(doc_type))
 
@@ -45,12 +136,40 @@ class DocMapping(object):
                 self.index = self.index or b._d.index
                 self._bulk = self._bulk or b._d._bulk
                 self._bulk_size = self._bulk_size or b._d._bulk_size
+                self._bulk_bytes = self._bulk_bytes or b._d._bulk_bytes
+                self._bulk_concurrency = self._bulk_concurrency or b._d._bulk_concurrency
+                self._bulk_adaptive = self._bulk_adaptive or b._d._bulk_adaptive
+                self._bulk_spill_dir = self._bulk_spill_dir or b._d._bulk_spill_dir
+                self._bulk_spill_threshold = self._bulk_spill_threshold or b._d._bulk_spill_threshold
+                self._bulk_compact = self._bulk_compact or b._d._bulk_compact
+                self._bulk_callback = self._bulk_callback or b._d._bulk_callback
+                self._bulk_coalesce = self._bulk_coalesce or b._d._bulk_coalesce
+                self._flush_interval = self._flush_interval or b._d._flush_interval
+                self._max_pending = self._max_pending or b._d._max_pending
                 self._read_only = self._read_only or b._d._read_only
+                self.routing_field = self.routing_field or b._d.routing_field
+                self.lazy = self.lazy or b._d.lazy
+                if self.hash_cache is None:
+                    self.hash_cache = b._d.hash_cache
+                if self.overlay is None:
+                    self.overlay = b._d.overlay
 
         # register all declared fields into the mapping
         for field_name, value in list(fields.iteritems()):
             if isinstance(value, BaseField):
                 self.mapping.field(field_name, value)
+        if self.hash_cache is not None and HASH_FIELD not in self.mapping:
+            # only ever read back from _source, never searched
+            self.mapping.field(HASH_FIELD, StringField(index='no'))
+
+    @staticmethod
+    def _make_hash_cache(option):
+        # True for an in-memory cache, a path for one on disk or a cache
+        if option is True:
+            return LRUHashCache()
+        if isinstance(option, string_types):
+            return DiskHashCache(option)
+        return option or None
 
     @property
     def doc_type(self):
@@ -60,6 +179,33 @@ class DocMapping(object):
     def using(self):
         return self._using or 'default'
 
+    @property
+    def spill_dir(self):
+        # every document class gets its own log
+        if self._bulk_spill_dir:
+            return os.path.join(self._bulk_spill_dir, self.doc_type)
+
+    def make_queue(self, **kwargs):
+        """
+        Build a bulk ``Queue`` configured from the ``meta`` options, any of
+        its arguments can be overridden with ``kwargs``.
+        """
+        options = dict(index=self.index,
+                       using=self.using,
+                       max_docs=self._bulk_size,
+                       max_bytes=self._bulk_bytes,
+                       flush_interval=self._flush_interval,
+                       max_pending=self._max_pending,
+                       concurrency=self._bulk_concurrency,
+                       adaptive=self._bulk_adaptive,
+                       spill_dir=self.spill_dir,
+                       spill_threshold=self._bulk_spill_threshold,
+                       compact=self._bulk_compact,
+                       callback=self._bulk_callback,
+                       coalesce=self._bulk_coalesce)
+        options.update(kwargs)
+        return Queue(**options)
+
     def init(self, index=None, using=None):
         self.mapping.save(index or self.index, using=using or self._using)
 
@@ -67,14 +213,126 @@ class DocMapping(object):
         self.mapping.update_from_es(index or self.index, using=using or self._using)
 
 
+class ClassQueue(object):
+    """
+    Class attribute standing for the bulk ``Queue`` of a document class
+    until it is first used: building it may replay a spill log and start
+    sending, which must not happen when the class is merely defined.
+    """
+    _lock = threading.Lock()
+
+    def __get__(self, instance, owner):
+        with self._lock:
+            queue = owner.__dict__.get('_queue', self)
+            if queue is self:
+                queue = owner._d.make_queue()
+                setattr(owner, '_queue', queue)
+        return queue
+
+
+class FieldDescriptor(object):
+    """
+    Class attribute standing for a declared field: the value lives in the
+    field's slot of the instance, the class attribute is the field itself.
+    A raw value hydrated lazily is converted on first access.
+    """
+    __slots__ = ('name', 'field', 'slot')
+
+    def __init__(self, name, field, slot=None):
+        self.name = name
+        self.field = field
+        self.slot = slot
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self.field
+        try:
+            return self.slot.__get__(instance, owner)
+        except AttributeError:
+            if instance._deferred is not None and self.name in instance._deferred[1]:
+                if instance._deferred[0] is not None:
+                    _load_deferred(instance._deferred[0])
+                if instance._deferred is not None:
+                    raise NotFoundError(404, 'Document %r is gone, its field %r could not be fetched.' % (
+                        instance.id, self.name))
+            lazy = instance._lazy
+            if not lazy or self.name not in lazy:
+                raise
+            value = self.field.to_python(lazy.pop(self.name))
+            self.slot.__set__(instance, value)
+            return value
+
+    def __set__(self, instance, value):
+        self.slot.__set__(instance, value)
+        if instance._lazy:
+            instance._lazy.pop(self.name, None)
+        _mark_changed(instance, self.name)
+
+    def __delete__(self, instance):
+        if instance._lazy and self.name in instance._lazy:
+            del instance._lazy[self.name]
+        else:
+            self.slot.__delete__(instance)
+        _mark_changed(instance, self.name)
+
+
+def _mark_changed(doc, name):
+    # frozensets, the empty one being shared by every unchanged document
+    changed = doc._changed
+    if changed is not None and name not in changed:
+        doc._changed = changed | frozenset((name, ))
+
+
+def _init_slots(doc):
+    for name, value in STATE_SLOTS:
+        _object_setattr(doc, name, value)
+
+
+def _has_value(doc, name):
+    try:
+        getattr(doc.__class__, SLOT_PREFIX + name).__get__(doc)
+    except AttributeError:
+        return False
+    return True
+
+
+def _load_deferred(source_filter):
+    """
+    Fetch the fields left out of the hits for every document of
+    ``source_filter`` still missing them, ``batch_size`` documents per
+    ``mget``. The values are converted when read, as with ``lazy``. Reading
+    the fields of a document no longer found raises ``NotFoundError``.
+    """
+    docs, source_filter.pending = [d for d in source_filter.pending if d._deferred is not None], []
+    es = connections.get_connection(source_filter.using)
+    for start in range(0, len(docs), source_filter.batch_size):
+        batch = docs[start:start + source_filter.batch_size]
+        try:
+            resp = es.mget(body={'docs': [d._mget_spec() for d in batch]},
+                           _source_include=sorted(set(n for d in batch for n in d._deferred[1])))
+        except Exception:
+            source_filter.pending.extend(docs[start:])
+            raise
+        for doc, found in zip(batch, resp['docs']):
+            if found.get('found', True):
+                source = found.get('_source', {})
+                lazy = doc._lazy or {}
+                for name in doc._deferred[1]:
+                    # unless it's been set in the meantime
+                    if not _has_value(doc, name):
+                        lazy[name] = source.get(name, doc._fields[name].default)
+                doc._lazy = lazy
+                doc._deferred = None
+            else:
+                doc._deferred = None, doc._deferred[1]
+
+
 class BaseDocumentMeta(type):
 
     def __new__(cls, name=None, bases=None, fields=None):
         super_new = super(BaseDocumentMeta, cls).__new__
         fields['_d'] = DocMapping(name, bases, fields)
-        fields['_queue'] = Queue(index=fields['_d'].index,
-                                 using=fields['_d'].using,
-                                 limit=fields['_d']._bulk_size or 100)
+        fields['_queue'] = ClassQueue()
 
         _fields = {}
         for b in bases:
@@ -83,19 +341,43 @@ class BaseDocumentMeta(type):
         _fields.update({field_name: field for field_name, field in fields.iteritems() if isinstance(field, BaseField)})
         fields['_fields'] = _fields
 
+        # one slot per field, fields redeclared by a subclass keep their parent's
+        declared = [n for n, f in fields.items() if isinstance(f, BaseField)]
+        slots = [SLOT_PREFIX + n for n in declared if not any(hasattr(b, SLOT_PREFIX + n) for b in bases)]
+        fields['__slots__'] = tuple(fields.get('__slots__', ())) + tuple(slots)
+        for field_name in declared:
+            fields[field_name] = FieldDescriptor(field_name, fields[field_name])
+
         new_class = super_new(cls, name, bases, fields)
+        for field_name in declared:
+            fields[field_name].slot = getattr(new_class, SLOT_PREFIX + field_name)
+        specialize(new_class, SLOT_PREFIX, STATE_SLOTS)
 
         new_class.query = Search(
             using=fields['_d'].using,
             index=fields['_d'].index,
-            doc_type={fields['_d'].doc_type: new_class.from_es})
+            doc_type={fields['_d'].doc_type: new_class.from_es},
+            routing_field=fields['_d'].routing_field)
 
         return new_class
 
 
 class BaseDocument(object):
+    # field values are in slots added by the metaclass, ``_extra`` has any
+    # other attribute set on the document, ``_lazy`` the raw values of
+    # fields not converted yet, ``_deferred`` the ``SourceFilter`` that left
+    # fields out of its hit (``None`` once the document turned out to be
+    # gone), with their names, ``_changed`` the names of what changed since
+    # it was loaded or saved (``None`` if never), ``_status`` and ``_error``
+    # the outcome of its last bulk write, ``_hash`` the index and content
+    # hash of a pending write, ``_overlay_entry`` its key and token in the
+    # class overlay and ``_written_changes`` the changes it writes (``False``
+    # without one)
+    __slots__ = ('_meta', ) + tuple(name for name, _ in STATE_SLOTS)
+
+    @generic
     def __init__(self, id=None, **kwargs):
-        self._data = {}
+        _init_slots(self)
         for name, field in self._fields.iteritems():
             if name in kwargs.keys():
                 setattr(self, name, field.to_python(kwargs.get(name)))
@@ -109,9 +391,42 @@ class BaseDocument(object):
 
 
     def __setattr__(self, key, value):
-        if key not in ['_data', '_meta']:
-            self._data[key] = value
-        super(BaseDocument, self).__setattr__(key, value)
+        try:
+            _object_setattr(self, key, value)
+        except AttributeError:
+            if hasattr(self.__class__, key):
+                raise
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+            _mark_changed(self, key)
+
+    def __getattr__(self, name):
+        # only called for what neither a field nor a slot has
+        if name != '_extra' and self._extra is not None and name in self._extra:
+            return self._extra[name]
+        raise AttributeError('%r object has no attribute %r' % (self.__class__.__name__, name))
+
+    def __delattr__(self, name):
+        try:
+            object.__delattr__(self, name)
+        except AttributeError:
+            if self._extra is None or name not in self._extra:
+                raise
+            del self._extra[name]
+            _mark_changed(self, name)
+
+    def __getstate__(self):
+        data = dict((name, getattr(self, name, None)) for name in self._fields)
+        data.update(self._extra or {})
+        return data, self._meta.to_dict()
+
+    def __setstate__(self, state):
+        data, meta = state
+        _init_slots(self)
+        for key, value in data.items():
+            setattr(self, key, value)
+        self._meta = ResultMeta(meta)
 
     @property
     def id(self):
@@ -143,17 +458,108 @@ class Document(BaseDocument):
         return count.get('count', 0)
 
     @classmethod
-    def from_es(cls, hit):
+    def load_file(cls, path, format=None, **kwargs):
+        """
+        Bulk load a NDJSON or CSV file of these documents, see
+        ``elasticsearch_dsl.load.load_file``.
+        """
+        return load_file(cls, path, format=format, **kwargs)
+
+    @classmethod
+    def from_es(cls, hit, source_filter=None):
+        """
+        Build a document from a search hit. ``source_filter`` is the
+        ``SourceFilter`` of a search leaving fields out of the ``_source``,
+        those are fetched when first read.
+        """
         doc = hit.copy()
-        doc.update(doc.pop('_source'))
-        return cls(id=doc.pop('_id'), **doc)
+        if cls._d.overlay is not None:
+            # a write not refreshed yet is more recent than the hit
+            found, source = cls._d.overlay.get(hash_key(hit['_index'], hit['_type'], hit['_id']))
+            if found and source is not None:
+                doc['_source'] = source
+                source_filter = None
+        source = doc.pop('_source')
+        doc.update(source)
+        if cls._d.hash_cache is not None and HASH_FIELD in doc:
+            cls._d.hash_cache.set(hash_key(hit['_index'], hit['_type'], hit['_id']), doc[HASH_FIELD])
+        if cls._d.lazy:
+            self = cls._from_es_lazy(doc)
+        else:
+            self = cls(id=doc.pop('_id'), **doc)
+        if source_filter is not None:
+            self._defer([name for name in source_filter.left_out(cls._fields) if name not in source],
+                        source_filter)
+        self._changed = frozenset()
+        return self
+    from_es.__func__.takes_source_filter = True
+
+    def _defer(self, names, source_filter):
+        """
+        Forget the values of the fields ``names``, left out of the hit, until
+        they are loaded through ``source_filter``.
+        """
+        if not names:
+            return
+        for name in names:
+            if self._lazy:
+                self._lazy.pop(name, None)
+            getattr(self.__class__, SLOT_PREFIX + name).__delete__(self)
+        self._deferred = source_filter, names
+        source_filter.pending.append(self)
+
+    def _mget_spec(self):
+        spec = {'_index': self._meta.index, '_type': self._d.doc_type, '_id': self.id}
+        if self._meta.get('routing') is not None:
+            spec['_routing'] = self._meta.routing
+        return spec
 
-    def validate(self):
+    @classmethod
+    def _from_es_lazy(cls, doc):
+        """
+        Build the document from ``doc`` (a hit with its ``_source`` merged
+        in) keeping the raw values of its fields, each is only converted
+        when first read.
+        """
+        self = cls.__new__(cls)
+        _init_slots(self)
+        self._lazy = {}
+        for name, field in cls._fields.iteritems():
+            if name in doc:
+                self._lazy[name] = doc[name]
+            else:
+                setattr(self, name, field.to_python(field.default))
+        meta = dict((k, v) for k, v in doc.iteritems() if k.startswith('_') and k[1:] in META_FIELDS)
+        meta['id'] = doc['_id']
+        self._meta = ResultMeta(meta)
+        return self
+
+    @classmethod
+    def fetch_hashes(cls, ids, index=None, using=None):
+        """
+        Load the content hashes stored with the documents ``ids`` into the
+        hash cache with a single ``mget``, under ``index`` (which ``save``
+        looks them up with) even if it's an alias.
+        """
+        es = connections.get_connection(using or cls._d._using)
+        index = index or cls._d.index
+        resp = es.mget(body={'ids': list(ids)}, index=index, doc_type=cls._d.doc_type,
+                       _source_include=HASH_FIELD)
+        for doc in resp['docs']:
+            value = doc.get('_source', {}).get(HASH_FIELD)
+            if doc.get('found') and value:
+                cls._d.hash_cache.set(hash_key(index, doc['_type'], doc['_id']), value)
+
+    @generic
+    def validate(self, names=None):
+        # only the fields in names if given, those not declared are skipped
         errors = []
-        for name, field in self._fields.iteritems():
+        for name in self._fields if names is None else names:
+            if name not in self._fields:
+                continue
             try:
                 value = getattr(self, name, None)
-                field.validate(value)
+                self._fields[name].validate(value)
             except ValidationError as e:
                 errors.append('{} {}'.format(name, e.message))
 
@@ -163,81 +569,345 @@ class Document(BaseDocument):
     def clean(self):
         pass
 
-    def delete(self, using=None, index=None, **kwargs):
+    def delete(self, using=None, index=None, bulk=False, flush=False, refresh=False, **kwargs):
         es = self._get_connection(using)
+        context = _bulk_context(self.__class__)
         if index is None:
-            index = getattr(self._meta, 'index', self._d.index)
+            index = getattr(self._meta, 'index', context.index if context else self._d.index)
         if index is None:
             raise #XXX - no index
         # extract parent, routing etc from _meta
         doc_meta = dict((k, self._meta[k]) for k in DOC_META_FIELDS if k in self._meta)
+        self._add_routing(doc_meta)
         doc_meta.update(kwargs)
+        if self._d.hash_cache is not None:
+            self._d.hash_cache.discard(hash_key(index, self._d.doc_type, self.id))
+        self._overlay_write(index, 'delete', using=using)
+        session = current_session()
+        if session is not None:
+            session.add(self, index, op_type='delete', refresh=refresh)
+            return True
+        if context is not None or bulk or self._d._bulk:
+            queue = context.queue if context else self._queue
+            queue.append(self, index, op_type='delete')
+            if flush or refresh:
+                queue.flush(index)
+            if refresh:
+                connections.refresh(index, using=queue.using)
+            return True
 
-        return _delete_document(es, index=index,
-                                doc_type=getattr(self._meta, 'doc_type', self._d.doc_type),
-                                extra=doc_meta)
+        try:
+            resp = _delete_document(es, index=index,
+                                    doc_type=getattr(self._meta, 'doc_type', self._d.doc_type),
+                                    extra=doc_meta)
+        except Exception:
+            self._overlay_confirm(False)
+            raise
+        self._overlay_confirm(True)
+        if refresh:
+            connections.refresh(index, using=using or self._d.using)
+        return resp
 
 
     @classmethod
     def get(cls, id, using=None, index=None, **kwargs):
+        """
+        Fetch document ``id``. With a ``routing_field`` in the class ``meta``
+        its value can be passed as a keyword argument instead of ``routing``.
+        """
+        index = index or cls._d.index
+        if cls._d.routing_field in kwargs:
+            kwargs.setdefault('routing', kwargs.pop(cls._d.routing_field))
+        if cls._d.overlay is not None:
+            found, source = cls._d.overlay.get(cls._overlay_key(index, id, using))
+            if found:
+                if source is None:
+                    raise NotFoundError(404, 'Document %r has been deleted.' % id)
+                return cls.from_es({'_index': index, '_type': cls._d.doc_type, '_id': id, '_source': source})
         es = connections.get_connection(using or cls._d._using)
-        doc = _get_document(es, index=index or cls._d.index,
+        doc = _get_document(es, index=index,
             doc_type=cls._d.doc_type,
             id=id,
-            **kwargs)
+            kwargs=kwargs)
         return cls.from_es(doc)
 
-    def save(self, using=None, index=None, bulk=False, flush=False, force=False, **kwargs):
+    def save(self, using=None, index=None, bulk=False, flush=False, force=False, op='index', script=None,
+             skip_unchanged=True, refresh=False, partial=False, **kwargs):
+        """
+        Save the document. ``op`` selects the write: ``'index'`` (the
+        default) replaces the whole document, ``'create'`` fails if it
+        already exists, ``'update'`` merges the fields that are set (not
+        ``None``) into the stored document (or runs ``script`` on it) and
+        ``'upsert'`` does the same but creates the document when missing.
+        With ``bulk=True`` the matching action is queued instead of sent
+        right away, as it is inside a ``BulkInsert``; inside a ``Session``
+        it is recorded and sent when the session commits.
+
+        With ``content_hash`` in the class ``meta`` an index or create of a
+        document whose content hash matches the one cached for it is skipped
+        (and ``False`` returned) unless ``skip_unchanged`` is ``False``.
+
+        ``refresh=True`` refreshes the index once the document is written
+        (flushing the queue first), through ``connections.refresh`` so that
+        refreshes requested at the same time are merged into one.
+
+        ``partial=True`` only validates and sends the fields changed since
+        the document was loaded or last saved, as an update, and nothing at
+        all (``False`` is returned) if none changed. A document that was
+        never loaded nor saved is written whole. Changes made inside mutable
+        values (lists, dicts) aren't noticed.
+        """
+        if op not in SAVE_OPS:
+            raise ValueError('Unknown save operation %r, use one of %s.' % (op, ', '.join(SAVE_OPS)))
+        if partial and (op not in ('index', 'update') or script is not None):
+            raise ValueError('partial=True only works with op index or update, without a script.')
         if not self._d._read_only or self._d._read_only and force:
+            fields = None
+            if partial and self._changed is not None:
+                if not self._changed:
+                    return False
+                op, fields = 'update', sorted(self._changed)
+
             self.clean()
-            self.validate()
+            # with fields, the others aren't sent, nor loaded if deferred
+            self.validate(fields)
 
             es = self._get_connection(using)
+            context = _bulk_context(self.__class__)
             if index is None:
-                index = getattr(self._meta, 'index', self._d.index)
+                index = getattr(self._meta, 'index', context.index if context else self._d.index)
             if index is None:
                 raise #XXX - no index
 
+            if self._d.hash_cache is not None and op in ('index', 'create'):
+                # hashed once, _source reuses it and _remember_hash stores it
+                # under the same index it is looked up with here
+                self._hash = index, content_hash(self.to_dict())
+                if skip_unchanged and self.id is not None and self._hash[1] == \
+                        self._d.hash_cache.get(hash_key(index, self._d.doc_type, self.id)):
+                    self._hash = None
+                    return False
+            elif self._d.hash_cache is not None and self.id is not None:
+                # a partial update leaves the stored hash stale
+                self._d.hash_cache.discard(hash_key(index, self._d.doc_type, self.id))
+            self._overlay_write(index, op, script, fields, using)
+
             # extract parent, routing etc from _meta
             doc_meta = dict((k, self._meta[k]) for k in DOC_META_FIELDS if k in self._meta)
+            self._add_routing(doc_meta)
             doc_meta.update(kwargs)
-            if bulk or self._d._bulk:
-                self._queue.append(self, index)
-                if flush:
-                    self._queue._send(index)
+            self._start_write()
+            # only partial writes pass fields, to_es overrides may not take them
+            action = dict(op_type=op, script=script)
+            if fields is not None:
+                action['fields'] = fields
+            session = current_session()
+            if session is not None:
+                session.add(self, index, refresh=refresh, **action)
+                return True
+            if context is not None or bulk or self._d._bulk:
+                queue = context.queue if context else self._queue
+                queue.append(self, index, **action)
+                if flush or refresh:
+                    queue.flush(index)
+                if refresh:
+                    connections.refresh(index, using=queue.using)
                 return True
 
-            meta = _save_document(es,
-                                  index=index,
-                                  doc_type=self._d.doc_type,
-                                  body=self.to_dict(),
-                                  extra=doc_meta)
+            try:
+                if op in ('update', 'upsert'):
+                    meta = _update_document(es,
+                                            index=index,
+                                            doc_type=self._d.doc_type,
+                                            body=self._update_body(op, script, fields),
+                                            extra=doc_meta)
+                else:
+                    if op == 'create':
+                        doc_meta['op_type'] = 'create'
+                    meta = _save_document(es,
+                                          index=index,
+                                          doc_type=self._d.doc_type,
+                                          body=self._source(),
+                                          extra=doc_meta)
+            except Exception:
+                self._remember_hash(False)
+                self._overlay_confirm(False)
+                self._confirm_write(False)
+                raise
             # update meta information from ES
             for k in META_FIELDS:
                 if '_{}'.format(k) in meta:
                     setattr(self._meta, k, meta['_{}'.format(k)])
+            self._remember_hash(True)
+            self._overlay_confirm(True)
+            self._confirm_write(True)
+            if refresh:
+                connections.refresh(index, using=using or self._d.using)
             # return True/False if the document has been created/updated
-            return meta['created']
+            return meta.get('created', False)
         raise ReadOnlyException('This document is read only. To force save set force=True in save call')
 
 
+    def _update_from_bulk(self, ok, info):
+        """
+        Take the outcome of this document's bulk action: ``_meta`` gets the
+        id, version and index assigned by elasticsearch, ``_status`` the
+        item status and ``_error`` its error (``None`` when it went through).
+        """
+        for k in META_FIELDS:
+            if '_{}'.format(k) in info:
+                setattr(self._meta, k, info['_{}'.format(k)])
+        self._status = info.get('status')
+        self._error = None if ok else info.get('error')
+        self._remember_hash(ok)
+        self._overlay_confirm(ok)
+        self._confirm_write(ok)
+
+    def _remember_hash(self, ok):
+        # only once it has been written, a failed write must not be skipped next time
+        if self._hash is not None:
+            if ok:
+                index, value = self._hash
+                self._d.hash_cache.set(hash_key(index, self._d.doc_type, self.id), value)
+            self._hash = None
+
+    @classmethod
+    def _overlay_key(cls, index, id, using=None):
+        """
+        Key of document ``id`` in the class overlay, with the index hits
+        report rather than an alias of it.
+        """
+        def lookup(name):
+            try:
+                indices = connections.get_connection(using or cls._d._using).indices.get_settings(index=name)
+            except NotFoundError:
+                # not created yet, it will be under this name
+                return name
+            return list(indices)[0] if len(indices) == 1 else name
+        return hash_key(cls._d.overlay.concrete_index(index, lookup), cls._d.doc_type, id)
+
+    def _overlay_write(self, index, op, script=None, fields=None, using=None):
+        """
+        Record a pending write in the class overlay (``read_your_writes``),
+        an update of only ``fields`` when given.
+        """
+        if self._d.overlay is None or self.id is None:
+            return
+        key = self._overlay_key(index, self.id, using)
+        if op in ('index', 'create'):
+            token = self._d.overlay.put(key, self.to_dict())
+        elif op == 'delete':
+            token = self._d.overlay.put(key, None)
+        elif script is None and fields is not None:
+            token = self._d.overlay.update(key, self._values(fields))
+        elif script is None:
+            token = self._d.overlay.update(key, dict((k, v) for k, v in self.to_dict().items() if v is not None))
+        else:
+            self._d.overlay.discard(key)
+            token = None
+        self._overlay_entry = None if token is None else (key, token)
+
+    def _start_write(self):
+        # the changes are written, _confirm_write puts them back if it fails
+        self._written_changes = self._changed
+        self._changed = frozenset()
+
+    def _confirm_write(self, ok):
+        # False when there's no write to confirm, None when all changed
+        written = self._written_changes
+        if written is False:
+            return
+        if not ok:
+            self._changed = None if written is None or self._changed is None else written | self._changed
+        self._written_changes = False
+
+    def _overlay_confirm(self, ok):
+        if self._overlay_entry is not None:
+            key, token = self._overlay_entry
+            if ok:
+                self._d.overlay.written(key, token)
+            else:
+                self._d.overlay.discard(key, token)
+            self._overlay_entry = None
+
+    def _add_routing(self, doc_meta):
+        """
+        Route on the value of the class ``routing_field`` unless ``_meta``
+        has a routing already.
+        """
+        if doc_meta.get('routing') is None and self._d.routing_field is not None:
+            routing = getattr(self, self._d.routing_field, None)
+            if routing is not None:
+                doc_meta['routing'] = routing
+
     def _get_connection(self, using=None):
         return connections.get_connection(using or self._d._using)
 
+    @generic
     def to_dict(self):
         data = {}
-        for key, value in self._data.iteritems():
-            if key in self._fields.keys():
-                value = getattr(self, key, None)
-                data[key] = self._fields[key].to_python(value)
+        lazy = self._lazy
+        for name, field in self._fields.iteritems():
+            if lazy and name in lazy:
+                # not converted yet, pass what elasticsearch returned
+                data[name] = lazy[name]
             else:
-                data[key] = getattr(self, key, None)
+                data[name] = field.to_python(getattr(self, name, None))
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+
+    def _source(self):
+        data = self.to_dict()
+        if self._d.hash_cache is not None:
+            data[HASH_FIELD] = self._hash[1] if self._hash is not None else content_hash(data)
         return data
 
+    def _update_body(self, op, script=None, fields=None):
+        if script is not None:
+            body = {'script': script}
+            if op == 'upsert':
+                body['upsert'] = self.to_dict()
+            return body
+        if fields is None:
+            # unset fields would overwrite the stored values with null
+            body = {'doc': dict((k, v) for k, v in self.to_dict().items() if v is not None)}
+        else:
+            # only the changed fields, without loading the others
+            body = {'doc': self._values(fields)}
+        if self._d.hash_cache is not None:
+            # the stored hash no longer matches what the merge produces
+            body['doc'][HASH_FIELD] = None
+        if op == 'upsert':
+            body['doc_as_upsert'] = True
+        return body
+
+    def _values(self, names):
+        data = {}
+        for name in names:
+            value = getattr(self, name, None)
+            data[name] = self._fields[name].to_python(value) if name in self._fields else value
+        return data
 
-    def to_es(self):
-        doc = {"_source": self.to_dict()}
-        doc_meta = dict((k, self._meta[k]) for k in FULL_META_FIELDS if k in self._meta)
+    def to_es(self, op_type='index', script=None, fields=None):
+        """
+        Return the document as an action for the bulk helpers, ``op_type``
+        being any of the ``save`` operations or ``'delete'``. An update only
+        carries ``fields`` when given.
+        """
+        if op_type == 'delete':
+            doc = {'_op_type': 'delete'}
+        elif op_type in ('update', 'upsert'):
+            doc = {'_op_type': 'update', '_source': self._update_body(op_type, script, fields)}
+        else:
+            doc = {'_op_type': op_type, '_source': self._source()}
+        doc_meta = dict((k, self._meta[k]) for k in DOC_META_FIELDS
+                        if k in self._meta and self._meta[k] is not None)
+        self._add_routing(doc_meta)
+        doc_meta = dict(('_{}'.format(k), v) for k, v in doc_meta.items())
+        if 'index' in self._meta:
+            doc_meta['_index'] = self._meta['index']
         doc_meta['_type'] = getattr(self._meta, 'doc_type', self._d.doc_type)
         doc.update(doc_meta)
         return doc
\ No newline at end of file
@@ -10,4 +10,11 @@ class UnknownDslObject(ElasticsearchDslException):
 
 
 class ValidationError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+class BulkError(ElasticsearchDslException):
+    @property
+    def errors(self):
+        """ List of ``BatchResult`` for the batches that failed. """
+        return self.args[1]
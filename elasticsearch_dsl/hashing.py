@@ -0,0 +1,117 @@
+import atexit
+import hashlib
+import json
+import logging
+import shelve
+import threading
+import weakref
+from collections import OrderedDict
+
+from elasticsearch.serializer import JSONSerializer
+from six import PY2, text_type
+
+__filename__ = 'hashing'
+
+# field of _source the content hash of a document is stored in
+HASH_FIELD = '_content_hash'
+
+_default = JSONSerializer().default
+
+logger = logging.getLogger('elasticsearch_dsl.hashing')
+
+# disk caches still open, closed on exit so that nothing written is lost
+_open_caches = weakref.WeakSet()
+
+
+@atexit.register
+def _close_caches():
+    for cache in list(_open_caches):
+        try:
+            cache.close()
+        except Exception:
+            logger.exception('Failed to close a DiskHashCache on exit.')
+
+
+def content_hash(data):
+    """
+    Stable hash of ``data`` (a document's ``to_dict()``), whatever the order
+    of its keys.
+    """
+    encoded = json.dumps(data, sort_keys=True, separators=(',', ':'), default=_default)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+def hash_key(index, doc_type, id):
+    return index, doc_type, text_type(id)
+
+
+class LRUHashCache(object):
+    """
+    Last known content hash of up to ``max_size`` documents, keyed by
+    ``(index, doc_type, id)``, the least recently used are forgotten first.
+    """
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self._hashes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def get(self, key):
+        with self._lock:
+            value = self._hashes.pop(key, None)
+            if value is not None:
+                self._hashes[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._hashes.pop(key, None)
+            self._hashes[key] = value
+            while len(self._hashes) > self.max_size:
+                self._hashes.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._hashes.pop(key, None)
+
+
+class DiskHashCache(object):
+    """
+    Content hashes kept in a ``shelve`` file at ``path`` so that they
+    survive restarts; it is never trimmed. ``close`` writes everything out,
+    caches still open are closed on interpreter exit.
+    """
+    def __init__(self, path):
+        self._shelf = shelve.open(path)
+        self._lock = threading.Lock()
+        _open_caches.add(self)
+
+    def __len__(self):
+        return len(self._shelf)
+
+    @staticmethod
+    def _key(key):
+        # shelve takes native strings only
+        key = u'/'.join(key)
+        return key.encode('utf-8') if PY2 else key
+
+    def get(self, key):
+        with self._lock:
+            return self._shelf.get(self._key(key))
+
+    def set(self, key, value):
+        with self._lock:
+            self._shelf[self._key(key)] = value
+
+    def discard(self, key):
+        with self._lock:
+            self._shelf.pop(self._key(key), None)
+
+    def close(self):
+        with self._lock:
+            if self._shelf is not None:
+                self._shelf.close()
+                self._shelf = None
+        _open_caches.discard(self)
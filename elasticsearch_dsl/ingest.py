@@ -0,0 +1,121 @@
+from collections import deque
+from multiprocessing import Pool, cpu_count
+
+from six import text_type
+
+from elasticsearch_dsl.exceptions import ValidationError
+from elasticsearch_dsl.fields import META_FIELDS
+from elasticsearch_dsl.queue import BulkItem
+
+__filename__ = 'ingest'
+
+
+def _chunks(docs, chunk_size):
+    chunk = []
+    for doc in docs:
+        chunk.append(doc)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _error_message(e):
+    # str() of a non ASCII message fails on python 2
+    try:
+        return text_type(e)
+    except UnicodeError:
+        return repr(e)
+
+
+def _encode_document(doc_class, index, op_type, doc):
+    """
+    Convert ``doc`` (a dict of field values or a ``doc_class`` instance),
+    clean and validate it and return its encoded ``(action, source)``.
+    """
+    if isinstance(doc, dict):
+        # every meta key (_id, _routing...) goes to _meta, whatever its
+        # place in the dict, and none of them to the fields
+        fields = dict(doc)
+        meta = dict((k[1:], fields.pop(k)) for k in list(fields) if k[:1] == '_' and k[1:] in META_FIELDS)
+        doc = doc_class(**fields)
+        for k, v in meta.items():
+            setattr(doc._meta, k, v)
+    doc.clean()
+    doc.validate()
+    item = BulkItem.from_document(doc, index, op_type=op_type)
+    return item.action, item.source
+
+
+def _encode_chunk(args):
+    """
+    Worker side of ``ingest``: turn a chunk of dicts or documents into their
+    encoded bulk lines. Returns the ``(action, source)`` pairs and a list of
+    ``(position in chunk, error message)`` for documents that didn't validate
+    or couldn't be converted.
+    """
+    doc_class, index, op_type, chunk = args
+    encoded, errors = [], []
+    for position, doc in enumerate(chunk):
+        try:
+            encoded.append(_encode_document(doc_class, index, op_type, doc))
+        except ValidationError as e:
+            errors.append((position, _error_message(e)))
+        except Exception as e:
+            # anything raised by to_python or clean only fails this document
+            errors.append((position, u'%s: %s' % (e.__class__.__name__, _error_message(e))))
+    return encoded, errors
+
+
+def ingest(doc_class, docs, index=None, op_type='index', processes=None, chunk_size=500, queue=None,
+           flush=True):
+    """
+    Bulk load ``docs`` (plain dicts of field values or ``doc_class``
+    instances) with the conversion, validation and JSON encoding done in a
+    ``multiprocessing`` pool of ``processes`` workers, ``chunk_size``
+    documents at a time. Encoded chunks are fed, in input order, to ``queue``
+    (``doc_class``'s own by default), which is flushed at the end unless
+    ``flush`` is ``False``.
+
+    ``doc_class`` has to be importable by the workers and documents passed in
+    are pickled to them, so they don't get any bulk results written back.
+
+    Returns the number of queued documents and a list of ``(position in
+    docs, error message)`` for those that failed validation or conversion.
+    """
+    queue = queue if queue is not None else doc_class._queue
+    index = index or doc_class._d.index
+    processes = processes or cpu_count()
+    state = {'queued': 0, 'offset': 0}
+    errors = []
+
+    def collect(result):
+        encoded, chunk_errors = result.get()
+        for action, source in encoded:
+            queue.append_encoded(action, source, index)
+        errors.extend((state['offset'] + position, message) for position, message in chunk_errors)
+        state['queued'] += len(encoded)
+        state['offset'] += len(encoded) + len(chunk_errors)
+
+    # only keep a couple of chunks per worker in flight so that neither the
+    # input nor the encoded output pile up in memory
+    in_flight = deque()
+    pool = Pool(processes)
+    try:
+        for chunk in _chunks(docs, chunk_size):
+            in_flight.append(pool.apply_async(_encode_chunk, ((doc_class, index, op_type, chunk), )))
+            if len(in_flight) >= 2 * processes:
+                collect(in_flight.popleft())
+        while in_flight:
+            collect(in_flight.popleft())
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    if flush:
+        queue.flush()
+    return state['queued'], errors
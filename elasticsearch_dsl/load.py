@@ -0,0 +1,212 @@
+import argparse
+import csv
+import importlib
+import json
+import logging
+import mmap
+import os
+import sys
+from collections import deque
+from multiprocessing import Pool, cpu_count
+
+from six import PY2
+
+from elasticsearch_dsl.connections import connections
+from elasticsearch_dsl.ingest import _encode_document, _error_message
+
+__filename__ = 'load'
+
+logger = logging.getLogger('elasticsearch_dsl.load')
+
+FORMATS = {
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.json': 'ndjson',
+    '.csv': 'csv',
+}
+
+
+def _open_map(path):
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _ranges(mm, start, chunk_bytes):
+    """
+    Split ``mm`` from ``start`` into ``(start, end)`` byte ranges of about
+    ``chunk_bytes``, each ending right after a newline (or at the end).
+    """
+    size = len(mm)
+    while start < size:
+        end = mm.find(b'\n', min(start + chunk_bytes, size) - 1)
+        end = size if end == -1 else end + 1
+        yield start, end
+        start = end
+
+
+def _lines(mm, start, end):
+    """
+    ``(offset, line)`` for every non blank line between ``start`` and ``end``.
+    """
+    mm.seek(start)
+    while mm.tell() < end:
+        offset = mm.tell()
+        line = mm.readline()
+        if line.strip():
+            yield offset, line
+
+
+def _parse_csv(line, fieldnames):
+    if not PY2:
+        line = line.decode('utf-8')
+    row = next(csv.reader([line]))
+    if len(row) != len(fieldnames):
+        raise ValueError('Expected %d columns, got %d.' % (len(fieldnames), len(row)))
+    if PY2:
+        row = [value.decode('utf-8') for value in row]
+    # empty columns are left to the field defaults
+    return dict((name, value) for name, value in zip(fieldnames, row) if value != '')
+
+
+def _load_range(args):
+    """
+    Worker side of ``load_file``: parse, validate and encode the lines of
+    one byte range of the file. Returns the encoded ``(action, source)``
+    pairs and ``(offset, line, error message)`` for every line rejected.
+    """
+    doc_class, path, format, fieldnames, start, end, index, op_type = args
+    mm = _open_map(path)
+    encoded, rejected = [], []
+    try:
+        for offset, line in _lines(mm, start, end):
+            try:
+                if format == 'csv':
+                    doc = _parse_csv(line, fieldnames)
+                else:
+                    doc = json.loads(line.decode('utf-8'))
+                encoded.append(_encode_document(doc_class, index, op_type, doc))
+            except Exception as e:
+                rejected.append((offset, line.rstrip(b'\r\n').decode('utf-8', 'replace'), _error_message(e)))
+    finally:
+        mm.close()
+    return encoded, rejected
+
+
+def load_file(doc_class, path, format=None, index=None, op_type='index', processes=None,
+              chunk_bytes=4 * 1024 * 1024, dead_letter=None, progress=None, queue=None, flush=True):
+    """
+    Bulk load a NDJSON (one JSON object per line) or CSV (with a header row)
+    file of ``doc_class`` documents; ``format`` is guessed from the file
+    extension when not given.
+
+    The file is memory mapped and split on line boundaries into ranges of
+    about ``chunk_bytes`` that ``processes`` worker processes parse, validate
+    and encode in parallel (CSV values can't span lines). The encoded
+    documents are fed, in file order, to ``queue`` (``doc_class``'s own by
+    default), which is flushed at the end unless ``flush`` is ``False``.
+
+    Lines that fail to parse or validate are written to ``dead_letter`` as
+    ``{"offset": ..., "error": ..., "line": ...}`` records, one per line.
+    ``progress`` is called with the statistics after every range.
+
+    Returns the statistics: file ``bytes`` processed out of ``total``,
+    documents ``loaded`` and lines ``rejected``.
+    """
+    if format is None:
+        format = FORMATS.get(os.path.splitext(path)[1].lower())
+    if format not in ('ndjson', 'csv'):
+        raise ValueError('Unknown file format %r, use ndjson or csv.' % format)
+    queue = queue if queue is not None else doc_class._queue
+    index = index or doc_class._d.index
+    processes = processes or cpu_count()
+    stats = {'bytes': 0, 'total': os.path.getsize(path), 'loaded': 0, 'rejected': 0}
+    if not stats['total']:
+        return stats
+
+    mm = _open_map(path)
+    start, fieldnames = 0, None
+    if format == 'csv':
+        header = mm.readline()
+        start = len(header)
+        fieldnames = next(csv.reader([header if PY2 else header.decode('utf-8')]))
+        stats['bytes'] = start
+
+    dead = open(dead_letter, 'a') if dead_letter is not None else None
+
+    def collect(result, size):
+        encoded, rejected = result.get()
+        for action, source in encoded:
+            queue.append_encoded(action, source, index)
+        for offset, line, error in rejected:
+            logger.debug('Rejected line at byte %d of %s: %s', offset, path, error)
+            if dead is not None:
+                dead.write(json.dumps({'offset': offset, 'error': error, 'line': line}) + '\n')
+        stats['bytes'] += size
+        stats['loaded'] += len(encoded)
+        stats['rejected'] += len(rejected)
+        if progress is not None:
+            progress(dict(stats))
+
+    # the workers map the file themselves, only the ranges are sent to them
+    in_flight = deque()
+    pool = Pool(processes)
+    try:
+        for start, end in _ranges(mm, start, chunk_bytes):
+            in_flight.append((pool.apply_async(_load_range, ((doc_class, path, format, fieldnames, start, end,
+                                                                index, op_type), )), end - start))
+            if len(in_flight) >= 2 * processes:
+                collect(*in_flight.popleft())
+        while in_flight:
+            collect(*in_flight.popleft())
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        mm.close()
+        if dead is not None:
+            dead.close()
+
+    if flush:
+        queue.flush()
+    return stats
+
+
+def _import(name):
+    module, _, attr = name.partition(':')
+    return getattr(importlib.import_module(module), attr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m elasticsearch_dsl.load',
+                                     description='Bulk load a NDJSON or CSV file into elasticsearch.')
+    parser.add_argument('document', help='document class to load, as package.module:Class')
+    parser.add_argument('path', help='file to load')
+    parser.add_argument('--format', choices=('ndjson', 'csv'), help='guessed from the extension by default')
+    parser.add_argument('--index', help="defaults to the document's index")
+    parser.add_argument('--op-type', default='index', choices=('index', 'create', 'update', 'upsert'))
+    parser.add_argument('--processes', type=int, help='worker processes, one per cpu by default')
+    parser.add_argument('--chunk-bytes', type=int, default=4 * 1024 * 1024)
+    parser.add_argument('--dead-letter', help='file to write rejected lines to')
+    parser.add_argument('--hosts', nargs='+', help="elasticsearch hosts for the document's connection")
+    args = parser.parse_args(argv)
+
+    doc_class = _import(args.document)
+    if args.hosts:
+        connections.create_connection(doc_class._d.using, hosts=args.hosts)
+
+    def report(stats):
+        sys.stderr.write('\r%5.1f%%  %d loaded  %d rejected' % (
+            100.0 * stats['bytes'] / stats['total'], stats['loaded'], stats['rejected']))
+        sys.stderr.flush()
+
+    stats = load_file(doc_class, args.path, format=args.format, index=args.index, op_type=args.op_type,
+                      processes=args.processes, chunk_bytes=args.chunk_bytes, dead_letter=args.dead_letter,
+                      progress=report)
+    sys.stderr.write('\n')
+    return 1 if stats['rejected'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
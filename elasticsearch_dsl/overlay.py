@@ -0,0 +1,120 @@
+import copy
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+from elasticsearch_dsl.queue import _merge_doc
+
+__filename__ = 'overlay'
+
+
+class Overlay(object):
+    """
+    Bounded per process store of the latest ``_source`` written for up to
+    ``max_size`` documents, keyed by ``(index, doc_type, id)``, ``None``
+    standing for a deletion.
+
+    Entries are kept while their write is pending and for ``ttl`` seconds
+    (the index refresh interval) once elasticsearch has confirmed it, after
+    which searches see it anyway. Writes never confirmed are dropped after
+    ``pending_ttl`` seconds. The oldest entries are evicted first when full.
+
+    ``put`` and ``update`` return a token for the write, ``written`` and
+    ``discard`` only touch the entry if no other write of it came since.
+
+    Keys name the concrete index, ``concrete_index`` remembers which one an
+    alias points to for ``alias_ttl`` seconds.
+    """
+    def __init__(self, max_size=10000, ttl=1.0, pending_ttl=60.0, alias_ttl=60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.alias_ttl = alias_ttl
+        # index or alias -> (concrete index, expiry time)
+        self._indices = {}
+        # key -> [source, expiry time, token of the latest write]
+        self._entries = OrderedDict()
+        self._tokens = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, key, source):
+        """
+        Record a pending write of ``source`` (``None`` for a delete) and
+        return its token.
+        """
+        with self._lock:
+            token = next(self._tokens)
+            self._entries.pop(key, None)
+            self._entries[key] = [copy.deepcopy(source), time.time() + self.pending_ttl, token]
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            return token
+
+    def update(self, key, changes):
+        """
+        Record a pending partial update and return its token, only possible
+        if the document is known, it is forgotten otherwise (and ``None``
+        returned).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is None:
+                self._entries.pop(key, None)
+                return None
+            token = entry[2] = next(self._tokens)
+            entry[0] = _merge_doc(entry[0], copy.deepcopy(changes))
+            entry[1] = time.time() + self.pending_ttl
+            return token
+
+    def written(self, key, token):
+        """
+        The write of ``key`` with ``token`` went through, keep it for ``ttl``
+        unless a later write of it is still pending.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] == token:
+                entry[1] = time.time() + self.ttl
+
+    def discard(self, key, token=None):
+        """
+        Forget ``key``, only if its latest write is the one with ``token``
+        when given.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (token is None or entry[2] == token):
+                del self._entries[key]
+
+    def concrete_index(self, index, lookup):
+        """
+        Return the concrete index ``index`` (possibly an alias) stands for, as
+        found by ``lookup(index)``.
+        """
+        now = time.time()
+        with self._lock:
+            known = self._indices.get(index)
+        if known is not None and known[1] >= now:
+            return known[0]
+        concrete = lookup(index)
+        with self._lock:
+            self._indices[index] = concrete, now + self.alias_ttl
+        return concrete
+
+    def get(self, key):
+        """
+        Return whether ``key`` is known and its latest ``_source`` (``None``
+        if deleted).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[1] < time.time():
+                del self._entries[key]
+                return False, None
+            return True, copy.deepcopy(entry[0])
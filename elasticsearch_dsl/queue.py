@@ -1,31 +1,752 @@
+import atexit
+import logging
+from array import array
+from collections import Counter
+import threading
+import time
+import warnings
+import weakref
+from multiprocessing.dummy import Pool as ThreadPool
+
+from elasticsearch.helpers import expand_action
+from elasticsearch.serializer import JSONSerializer
+
 from elasticsearch_dsl.connections import connections
-from elasticsearch_dsl.utils import _bulk
+from elasticsearch_dsl.exceptions import BulkError
+from elasticsearch_dsl.spill import SegmentLog
+from elasticsearch_dsl.utils import _backoff, _bulk
 
 __author__ = 'Matthew Moon'
 __filename__ = 'queue'
 
+logger = logging.getLogger('elasticsearch_dsl.queue')
+
+serializer = JSONSerializer()
+
+# queues with a background thread, closed when the interpreter exits
+_open_queues = weakref.WeakSet()
+
+
+@atexit.register
+def _close_queues():
+    for queue in list(_open_queues):
+        try:
+            queue.close()
+        except Exception:
+            logger.exception('Failed to flush a bulk Queue on exit.')
+
+
+class BulkItem(object):
+    """
+    A single pending bulk operation: the document it came from and its
+    already serialized action and source lines. Items replayed from a spill
+    log have no document but remember the ``segment`` they were read from.
+    """
+    __slots__ = ('document', 'action', 'source', 'size', 'segment', 'key')
+
+    def __init__(self, document, action, source=None, segment=None):
+        self.document = document
+        self.action = action
+        self.source = source
+        self.segment = segment
+        # (queue index, index, doc_type, id, routing) while it's the latest
+        # pending version of its document in a coalescing queue
+        self.key = None
+        # bytes taken in the request body, including the newlines
+        self.size = len(action) + 1
+        if source is not None:
+            self.size += len(source) + 1
+
+    @classmethod
+    def from_document(cls, document, index=None, **kwargs):
+        doc = document.to_es(**kwargs)
+        if index is not None:
+            doc.setdefault('_index', index)
+        action, source = expand_action(doc)
+        return cls(document, serializer.dumps(action),
+                   serializer.dumps(source) if source is not None else None)
+
+
+def _encode(line):
+    if not isinstance(line, bytes):
+        line = line.encode('utf-8')
+    return line
+
+
+def _merge_doc(doc, changes):
+    """
+    Apply partial ``changes`` to ``doc`` the way an update merges them.
+    """
+    doc = dict(doc)
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(doc.get(key), dict):
+            value = _merge_doc(doc[key], value)
+        doc[key] = value
+    return doc
+
+
+def _coalesce(previous, current):
+    """
+    Combine two consecutive ``(op_type, source)`` for one document into one
+    with the same outcome, or return ``None`` if they can't be. Only pairs
+    that can't fail differently once merged are: two indexes, an index
+    followed by a partial update and a delete followed by a create.
+    """
+    prev_op, prev_source = previous
+    op, source = current
+    if prev_op == 'index' and op == 'index':
+        return current
+    if prev_op == 'index' and op == 'update' and 'script' not in source:
+        # the document exists by then, an upsert is a plain update
+        return 'index', _merge_doc(prev_source, source['doc'])
+    if prev_op == 'delete' and op == 'create':
+        # it's gone by then, creating can't conflict
+        return 'index', source
+    return None
+
+
+class PackedBuffer(object):
+    """
+    Pending items of one index encoded back to back, newlines included, in a
+    single ``bytearray``, with only the length of each line kept next to it.
+    Neither the documents nor ``BulkItem`` instances are held on to.
+    """
+    def __init__(self):
+        self.data = bytearray()
+        # action and source line lengths (-1 for no source) of every item
+        self.lengths = array('l')
+
+    def __len__(self):
+        return len(self.lengths) // 2
+
+    def extend(self, items):
+        for item in items:
+            action = _encode(item.action)
+            self.data += action
+            self.data += b'\n'
+            if item.source is None:
+                self.lengths.extend((len(action), -1))
+            else:
+                source = _encode(item.source)
+                self.data += source
+                self.data += b'\n'
+                self.lengths.extend((len(action), len(source)))
+
+    def sizes(self):
+        lengths = self.lengths
+        for i in range(0, len(lengths), 2):
+            yield lengths[i] + 1 + (lengths[i + 1] + 1 if lengths[i + 1] >= 0 else 0)
+
+    def take(self, count, size):
+        """
+        Remove the first ``count`` items, ``size`` bytes, as ``PackedItems``.
+        """
+        if count == len(self):
+            # hand over the whole buffer instead of copying it
+            data, self.data = self.data, bytearray()
+        else:
+            data = self.data[:size]
+            del self.data[:size]
+        lengths = self.lengths[:count * 2]
+        del self.lengths[:count * 2]
+        return PackedItems(data, lengths)
+
+
+class PackedItems(object):
+    """
+    Items taken out of a ``PackedBuffer``; ``body`` is the request body for
+    all of them, iterating rebuilds the individual ``BulkItem``.
+    """
+    def __init__(self, body, lengths):
+        self.body = body
+        self.lengths = lengths
+
+    def __len__(self):
+        return len(self.lengths) // 2
+
+    def __iter__(self):
+        view, offset = memoryview(self.body), 0
+        for i in range(0, len(self.lengths), 2):
+            action_length, source_length = self.lengths[i], self.lengths[i + 1]
+            action = view[offset:offset + action_length].tobytes()
+            offset += action_length + 1
+            source = None
+            if source_length >= 0:
+                source = view[offset:offset + source_length].tobytes()
+                offset += source_length + 1
+            yield BulkItem(None, action, source)
+
+
+class BatchResult(object):
+    """
+    Outcome of sending one batch of ``BulkItem`` for ``index``: either the
+    ``response`` (one ``(ok, {op_type: item})`` per item) or the ``error``
+    raised while sending it.
+    """
+    __slots__ = ('index', 'items', 'response', 'error')
+
+    def __init__(self, index, items, response=None, error=None):
+        self.index = index
+        self.items = items
+        self.response = response
+        self.error = error
+
+    @property
+    def errors(self):
+        """
+        List of ``(BulkItem, {op_type: item})`` for the items elasticsearch
+        did not accept.
+        """
+        if not self.response or all(ok for ok, _ in self.response):
+            return []
+        return [(item, info) for item, (ok, info) in zip(self.items, self.response) if not ok]
+
+    @property
+    def ok(self):
+        return self.error is None and not self.errors
+
+    def write_back(self):
+        """
+        Hand every document still attached to an item its own outcome
+        through its ``_update_from_bulk(ok, info)``, if it has one.
+        """
+        if self.error is not None:
+            info = {'status': getattr(self.error, 'status_code', None), 'error': str(self.error)}
+            outcomes = ((item, False, info) for item in self.items)
+        else:
+            outcomes = ((item, ok, list(info.values())[0])
+                        for item, (ok, info) in zip(self.items, self.response or ()))
+        for item, ok, info in outcomes:
+            update = getattr(item.document, '_update_from_bulk', None)
+            if update is not None:
+                update(ok, info)
+
+
+class AdaptiveController(object):
+    """
+    Tunes bulk batch size and the number of requests in flight with AIMD:
+    every request that gets through within ``target_latency`` seconds grows
+    the batch by ``batch_step`` documents (and, once the batch is at
+    ``max_batch_size``, concurrency by one); any rejection from the cluster
+    multiplies both by ``decrease``. Requests slower than ``target_latency``
+    keep the settings where they are.
+
+    Current settings and the measured latency, rejection rate and throughput
+    (exponentially weighted averages) are available as attributes.
+    """
+    def __init__(self, batch_size=100, concurrency=1, min_batch_size=10, max_batch_size=5000,
+                 max_concurrency=8, batch_step=None, target_latency=2.0, decrease=0.5, weight=0.2):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.batch_step = batch_step or max(1, min_batch_size)
+        self.target_latency = target_latency
+        self.decrease = decrease
+        self.weight = weight
+        self.latency = None
+        self.rejection_rate = 0.0
+        self.throughput = None
+        self._lock = threading.Lock()
+
+    def _average(self, current, value):
+        if current is None:
+            return value
+        return (1 - self.weight) * current + self.weight * value
+
+    def record(self, docs, latency, rejected):
+        """
+        Account for one bulk request of ``docs`` items that took ``latency``
+        seconds and had ``rejected`` of its items refused.
+        """
+        with self._lock:
+            self.latency = self._average(self.latency, latency)
+            self.rejection_rate = self._average(self.rejection_rate, float(rejected) / docs if docs else 0.0)
+            if latency > 0:
+                self.throughput = self._average(self.throughput, (docs - rejected) / latency)
+
+            if rejected:
+                self.batch_size = max(self.min_batch_size, int(self.batch_size * self.decrease))
+                self.concurrency = max(1, int(self.concurrency * self.decrease))
+            elif latency <= self.target_latency:
+                if self.batch_size < self.max_batch_size:
+                    self.batch_size = min(self.max_batch_size, self.batch_size + self.batch_step)
+                elif self.concurrency < self.max_concurrency:
+                    self.concurrency += 1
+
+    def settings(self):
+        return {
+            'batch_size': self.batch_size,
+            'concurrency': self.concurrency,
+            'latency': self.latency,
+            'rejection_rate': self.rejection_rate,
+            'throughput': self.throughput,
+        }
+
 
 class Queue(object):
-    def __init__(self, index=None, using=None, limit=None):
+    """
+    Per document class buffer of pending bulk operations.
+
+    Documents are appended by ``Document.save(bulk=True)`` from any number of
+    threads and serialized right away. A background thread sends them to
+    elasticsearch once an index has collected ``max_docs`` documents or
+    ``max_bytes`` of request body, or its oldest document has waited for
+    ``flush_interval`` seconds. A document bigger than ``max_bytes`` on its
+    own is sent (and reported) in a request by itself. When ``max_pending``
+    documents are waiting (queued or being sent) producers block until there
+    is room again. Anything still pending is flushed when the interpreter
+    exits. Batches the background thread failed to send, or that had items
+    rejected, are kept and raised (in a ``BulkError``) by the next ``flush``
+    or ``close``.
+
+    Up to ``concurrency`` bulk requests are sent at the same time from a pool
+    of worker threads; their outcome is reported per batch, in order. Items
+    rejected with 429 or 503 are resent on their own up to ``max_retries``
+    times, other failures are reported per document. Batches in flight
+    together may be applied in any order: with ``concurrency`` over 1 there
+    is no ordering guarantee for writes of the same id in different batches,
+    an older one can land last.
+
+    With ``adaptive`` set (``True`` or an ``AdaptiveController``) the batch
+    size and concurrency are not fixed but follow the controller, which
+    reacts to the latency and rejections of every request.
+
+    With ``spill_dir`` set, items that would take the in-memory buffer over
+    ``spill_threshold`` bytes are appended to a ``SegmentLog`` in that
+    directory instead (and producers never block on ``max_pending``). The
+    log is read back in order as memory frees up, replayed when a queue is
+    created over an existing directory, and its segments are deleted once
+    delivered. Batches that fail as a whole, in memory and replayed items
+    alike, are kept and tried again instead of being dropped, their index
+    waiting longer (with exponential backoff) after every failure in a row.
+
+    With ``compact`` set the items of every index are kept encoded in a
+    ``PackedBuffer`` so that a pending document costs only its encoded size
+    and the buffer is sent as the request body as is. Compact queues cannot
+    spill to disk.
+
+    Once a batch has been sent, every document still attached to its item
+    gets its own outcome through ``_update_from_bulk(ok, info)`` (when it has
+    one), ``info`` being its item of the bulk response. Items replayed from
+    disk or kept in a compact buffer have no document to report to.
+    ``callback``, if given, is then called with the ``BatchResult`` from the
+    thread that sent it.
+
+    With ``coalesce`` set only the latest version of every document (by
+    index, type, id and routing) waits in memory where merging can't change
+    the outcome: an index replaces a pending index, a partial update is
+    merged into it and a create following a delete becomes an index. Other
+    writes of the same document are queued as they come. The documents
+    replaced this way get no bulk results written back. Items without an
+    id, spilled to disk or already being sent are never coalesced; compact
+    queues can't coalesce.
+
+    ``limit`` is the deprecated name of ``max_docs``.
+    """
+    def __init__(self, index=None, using=None, max_docs=None, max_bytes=None,
+                 flush_interval=None, max_pending=None, concurrency=None, max_retries=5,
+                 adaptive=None, spill_dir=None, spill_threshold=None, compact=False, callback=None,
+                 coalesce=False, limit=None):
+        if limit is not None:
+            warnings.warn('Queue(limit=...) is deprecated, use max_docs instead.', DeprecationWarning,
+                          stacklevel=2)
+            max_docs = max_docs or limit
         self.index = index
         self.using = using
-        self.limit = limit or 100
+        self.controller = None
+        self.max_docs = max_docs or 100
+        self.max_bytes = max_bytes or 10 * 1024 * 1024
+        self.flush_interval = flush_interval or 5.0
+        self.max_pending = max_pending
+        self.concurrency = concurrency or 1
+        self.max_retries = max_retries
+        self.callback = callback
+        if adaptive is True:
+            adaptive = AdaptiveController(batch_size=self.max_docs, concurrency=self.concurrency)
+        self.controller = adaptive
+        if compact and spill_dir:
+            raise ValueError('A compact Queue cannot spill to disk.')
+        self.compact = compact
+        if compact and coalesce:
+            raise ValueError('A compact Queue cannot coalesce documents.')
+        self.coalesce = coalesce
+        self._latest = {}
+        self.spill_threshold = spill_threshold or 64 * 1024 * 1024
+        self._log = SegmentLog(spill_dir) if spill_dir else None
+        self._memory = 0
         self._queue = {}
+        self._bytes = {}
+        self._since = {}
+        self._pending = 0
+        self._in_flight = 0
+        # BatchResult of the failed batches no flush has raised yet
+        self._failed = []
+        # index -> (failures in a row, time until which it isn't sent again)
+        self._retry = {}
+        self._blocked = 0
+        self._closed = False
+        self._thread = None
+        self._pool = None
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+
+        if self._log is not None and len(self._log):
+            # replay what a previous process left behind
+            self._pending += len(self._log)
+            self._ensure_thread()
+
+    def __len__(self):
+        return self._pending
+
+    def append(self, document, index='default', **kwargs):
+        """
+        Queue ``document``, any keyword arguments (``op_type``, ``script``)
+        are passed to its ``to_es`` to build the bulk action.
+        """
+        item = BulkItem.from_document(document, index, **kwargs)
+        if item.size > self.max_bytes:
+            logger.warning('Document %r is %d bytes, more than max_bytes (%d), it will be sent on its own.',
+                           getattr(document, 'id', None), item.size, self.max_bytes)
+        self._append(item, index)
+
+    def append_encoded(self, action, source=None, index='default', document=None):
+        """
+        Queue an already serialized action (and source) line. ``document``, if
+        given, gets its bulk result written back like a queued document.
+        """
+        self._append(BulkItem(document, action, source), index)
+
+    def _append(self, item, index):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Queue is closed.')
+            if self._log is not None:
+                # once anything is on disk, keep appending there to keep the order
+                if len(self._log) or self._memory + item.size > self.spill_threshold:
+                    self._log.append(index, item.action, item.source)
+                    self._pending += 1
+                    self._ensure_thread()
+                    self._changed.notify_all()
+                    return
+            else:
+                while self.max_pending and self._pending >= self.max_pending:
+                    self._blocked += 1
+                    self._changed.notify_all()
+                    try:
+                        self._changed.wait()
+                    finally:
+                        self._blocked -= 1
+
+            if self.coalesce and self._coalesce(index, item):
+                return
+            self._enqueue(index, [item], time.time())
+            self._pending += 1
+
+            self._ensure_thread()
+            if self._full(index) or len(self._queue[index]) == 1:
+                self._changed.notify_all()
+
+    def _coalesce(self, index, item):
+        """
+        Fold ``item`` into the pending version of the same document, if any,
+        and tell whether it was.
+        """
+        op_type, meta = next(iter(serializer.loads(item.action).items()))
+        if meta.get('_id') is None:
+            return False
+        key = (index, meta.get('_index', index), meta.get('_type'), meta['_id'], meta.get('_routing'))
+        pending = self._latest.get(key)
+        if pending is not None:
+            previous = next(iter(serializer.loads(pending.action)))
+            prev_source = serializer.loads(pending.source) if pending.source is not None else None
+            source = serializer.loads(item.source) if item.source is not None else None
+            merged = _coalesce((previous, prev_source), (op_type, source))
+            if merged is not None:
+                op_type, source = merged
+                size = pending.size
+                pending.__init__(item.document, serializer.dumps({op_type: meta}),
+                                 serializer.dumps(source) if source is not None else None)
+                pending.key = key
+                self._bytes[index] += pending.size - size
+                self._memory += pending.size - size
+                return True
+            pending.key = None
+        item.key = key
+        self._latest[key] = item
+        return False
+
+    def _enqueue(self, index, items, since, front=False):
+        if index not in self._queue:
+            self._queue[index] = PackedBuffer() if self.compact else []
+            self._bytes[index] = 0
+            self._since[index] = since
+        if front:
+            self._queue[index][:0] = items
+            self._since[index] = min(since, self._since[index])
+        else:
+            self._queue[index].extend(items)
+        size = sum(item.size for item in items)
+        self._bytes[index] += size
+        self._memory += size
+
+    def _load(self):
+        """
+        Move spilled items back into memory while there is room for them.
+        """
+        if self._log is None or not len(self._log) or self._memory >= self.spill_threshold:
+            return
+        for segment, index, action, source in self._log.read(self.spill_threshold - self._memory):
+            item = BulkItem(None, serializer.dumps(action),
+                            serializer.dumps(source) if source is not None else None, segment)
+            # these have been waiting long enough, make them due right away
+            self._enqueue(index, [item], 0)
+
+    def flush(self, index=None):
+        """
+        Send everything pending (for ``index`` only if given) from the calling
+        thread, ``concurrency`` requests at a time, and wait for batches
+        already being sent by the background thread to finish.
+
+        Raises ``BulkError`` listing the failed batches, if any, including
+        those sent by the background thread since the last flush. When items
+        are spilled to disk everything is flushed, whatever ``index`` is.
+        """
+        failed, total = [], 0
+        while not failed:
+            with self._lock:
+                self._load()
+                if index is not None and not (self._log is not None and len(self._log)):
+                    indices = [index]
+                else:
+                    indices = list(self._queue)
+                batches = []
+                for i in indices:
+                    while i in self._queue:
+                        batches.append((i, self._take(i)))
+            if not batches:
+                break
+            total += len(batches)
+            for start in range(0, len(batches), self.concurrency):
+                results = self._send_batches(batches[start:start + self.concurrency])
+                failed.extend(r for r in results if not r.ok)
+        with self._lock:
+            while self._in_flight:
+                self._changed.wait()
+            # and what the background thread failed to send since the last flush
+            background = [r for r in self._failed if r not in failed]
+            self._failed = []
+        failed.extend(background)
+        total += len(background)
+        if failed:
+            raise BulkError('%d of %d batch(es) failed.' % (len(failed), total), failed)
+
+    def send_soon(self, index):
+        """
+        Have the background thread send what is pending for ``index`` right
+        away instead of once it is due, without waiting for it.
+        """
+        with self._lock:
+            if index in self._since:
+                self._since[index] = 0
+                self._changed.notify_all()
+
+    def close(self):
+        """
+        Stop the background thread and flush anything still pending.
+        """
+        with self._lock:
+            self._closed = True
+            self._changed.notify_all()
+            thread = self._thread
+        _open_queues.discard(self)
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        try:
+            self.flush()
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+            if self._log is not None:
+                self._log.close()
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='elasticsearch-dsl-queue')
+            self._thread.daemon = True
+            self._thread.start()
+            _open_queues.add(self)
+
+    @property
+    def max_docs(self):
+        if self.controller is not None:
+            return self.controller.batch_size
+        return self._max_docs
+
+    @max_docs.setter
+    def max_docs(self, value):
+        self._max_docs = value
+
+    # deprecated name of max_docs
+    limit = max_docs
+
+    @property
+    def concurrency(self):
+        if self.controller is not None:
+            return self.controller.concurrency
+        return self._concurrency
+
+    @concurrency.setter
+    def concurrency(self, value):
+        self._concurrency = value
+
+    def _full(self, index):
+        return len(self._queue[index]) >= self.max_docs or self._bytes[index] >= self.max_bytes
+
+    def _take(self, index):
+        """
+        Remove the oldest items for ``index`` that fit into one request.
+        """
+        items = self._queue[index]
+        count, size = 0, 0
+        for item_size in (items.sizes() if self.compact else (item.size for item in items)):
+            if count and (count == self.max_docs or size + item_size > self.max_bytes):
+                break
+            count += 1
+            size += item_size
+
+        if self.compact:
+            batch = items.take(count, size)
+        else:
+            batch = items[:count]
+            del items[:count]
+        self._memory -= size
+        for item in batch if self.coalesce else ():
+            if item.key is not None:
+                del self._latest[item.key]
+                item.key = None
+        if items:
+            self._bytes[index] -= size
+        else:
+            del self._queue[index], self._bytes[index], self._since[index]
+        self._in_flight += len(batch)
+        return batch
+
+    def _ready(self, now):
+        """
+        Return an index that should be flushed now and the number of seconds
+        until the next one becomes due.
+        """
+        self._load()
+        if self._blocked and self._queue:
+            # producers are waiting for room, flush the biggest backlog
+            return max(self._queue, key=lambda i: len(self._queue[i])), 0
+
+        wait = None
+        for index in self._queue:
+            if index in self._retry and self._retry[index][1] > now:
+                due = self._retry[index][1] - now
+                wait = due if wait is None else min(wait, due)
+                continue
+            due = self._since[index] + self.flush_interval - now
+            if self._full(index) or due <= 0:
+                return index, 0
+            wait = due if wait is None else min(wait, due)
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while True:
+                    index, wait = self._ready(time.time())
+                    if index is not None or self._closed:
+                        break
+                    self._changed.wait(wait)
+                if index is None:
+                    return
+                batches = [(index, self._take(index))]
+                while len(batches) < self.concurrency:
+                    index, _ = self._ready(time.time())
+                    if index is None:
+                        break
+                    batches.append((index, self._take(index)))
+
+            for result in self._send_batches(batches):
+                if result.error is not None:
+                    logger.error('Failed to send %d document(s) to %r: %s',
+                                 len(result.items), result.index, result.error)
+                for item, info in result.errors:
+                    logger.error('Document rejected by %r: %s', result.index, info)
 
-    def append(self, document, index='default'):
-        if index not in self._queue.keys():
-            self._queue[index] = []
-        self._queue[index].append(document)
+    def _send_batches(self, batches):
+        """
+        Send ``batches`` in parallel and return their ``BatchResult`` in the
+        same order.
+        """
+        if len(batches) == 1:
+            return [self._send_batch(batches[0])]
+        if self._pool is None:
+            size = self.controller.max_concurrency if self.controller is not None else self.concurrency
+            self._pool = ThreadPool(size)
+        return self._pool.map(self._send_batch, batches)
 
-        if len(self._queue[index]) >= self.limit:
-            self._send(index)
+    def _send_batch(self, batch):
+        index, items = batch
+        result = BatchResult(index, items)
+        try:
+            if items:
+                result.response = self._send(index, items)
+        except Exception as e:
+            result.error = e
+        finally:
+            self._report(result)
+            # with a spill log nothing is dropped before elasticsearch answered
+            # for it, the in-memory items of the batch are kept with the spilled ones
+            keep = items if result.error is not None and self._log is not None else []
+            with self._lock:
+                if not result.ok and len(keep) < len(items):
+                    # raised by the next flush
+                    self._failed.append(result)
+                self._in_flight -= len(items)
+                self._pending -= len(items) - len(keep)
+                if keep:
+                    # back off instead of resending right away while the cluster is down
+                    failures = self._retry.get(index, (0, 0))[0] + 1
+                    now = time.time()
+                    self._retry[index] = failures, now + _backoff(failures, 1, 60)
+                    self._enqueue(index, keep, now, front=True)
+                else:
+                    if result.error is None:
+                        self._retry.pop(index, None)
+                    if self._log is not None:
+                        for segment, count in Counter(item.segment for item in items
+                                                      if item.segment is not None).items():
+                            self._log.ack(segment, count)
+                self._changed.notify_all()
+        return result
 
-    def _iter_queue(self, queue='default'):
-        for item in self._queue.get(queue, []):
-            yield item.to_es()
+    def _report(self, result):
+        """
+        Write the outcome of every item in ``result`` back onto its document
+        and pass ``result`` on to ``callback``.
+        """
+        try:
+            if not self.compact:
+                result.write_back()
+            if self.callback is not None:
+                self.callback(result)
+        except Exception:
+            logger.exception('Failed to report the outcome of %d document(s) sent to %r.',
+                             len(result.items), result.index)
 
-    def _send(self, index):
+    def _send(self, index, batch):
         es = connections.get_connection(self.using)
         index = (index or self.index)
-        _bulk(conn=es, index=index, actions=self._iter_queue(index), chunk_size=self.limit, timeout=60)
-        self._queue[index] = []
+        # the batch already respects max_docs and max_bytes, send it as one request
+        return _bulk(conn=es, index=index, actions=batch, timeout=60, body=getattr(batch, 'body', None),
+                     expand_action_callback=lambda item: (item.action, item.source),
+                     max_retries=self.max_retries,
+                     on_response=self.controller.record if self.controller is not None else None)
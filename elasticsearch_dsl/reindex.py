@@ -0,0 +1,195 @@
+import json
+import logging
+import os
+import threading
+import time
+from multiprocessing.dummy import Pool as ThreadPool
+
+from elasticsearch.helpers import expand_action
+
+from elasticsearch_dsl.connections import connections
+from elasticsearch_dsl.exceptions import BulkError
+from elasticsearch_dsl.queue import Queue, serializer
+from elasticsearch_dsl.utils import _scan
+
+__filename__ = 'reindex'
+
+logger = logging.getLogger('elasticsearch_dsl.reindex')
+
+# hit metadata carried over to the bulk action
+HIT_META_FIELDS = ('_id', '_type', '_routing', '_parent', '_timestamp', '_ttl')
+
+
+class _ShardWrites(object):
+    """
+    Stands for the documents of one shard in the bulk ``Queue``, counts
+    those still pending and those that didn't make it from the results
+    written back to it.
+    """
+    def __init__(self):
+        self.failed = 0
+        self.pending = 0
+        self._changed = threading.Condition()
+
+    def add(self):
+        with self._changed:
+            self.pending += 1
+
+    def _update_from_bulk(self, ok, info):
+        with self._changed:
+            self.pending -= 1
+            if not ok:
+                self.failed += 1
+            self._changed.notify_all()
+
+    def wait(self):
+        """
+        Wait until every document added has had its result written back.
+        """
+        with self._changed:
+            while self.pending > 0:
+                self._changed.wait()
+
+
+def _shard_count(es, index):
+    resp = es.search_shards(index=index)
+    return max(copy['shard'] for group in resp['shards'] for copy in group) + 1
+
+
+def _load_checkpoint(path):
+    if path is None or not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return set(json.load(f)['shards'])
+
+
+def _save_checkpoint(path, shards):
+    # write a new file and move it over the old one so a crash never leaves
+    # a half written checkpoint behind
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'shards': sorted(shards)}, f)
+    os.rename(tmp, path)
+
+
+def _index_settings(es, index):
+    # keyed by the concrete index, index may be an alias
+    settings = list(es.indices.get_settings(index=index).values())[0]['settings']['index']
+    return {
+        'refresh_interval': settings.get('refresh_interval', '1s'),
+        'number_of_replicas': settings.get('number_of_replicas', 1),
+    }
+
+
+def _swap_alias(es, alias, index):
+    actions = []
+    if es.indices.exists_alias(name=alias):
+        for old in es.indices.get_alias(name=alias):
+            actions.append({'remove': {'index': old, 'alias': alias}})
+    actions.append({'add': {'index': index, 'alias': alias}})
+    es.indices.update_aliases(body={'actions': actions})
+
+
+def reindex(source_search, target_index, transform=None, using=None, readers=None, writers=2,
+            batch_size=500, scroll='5m', checkpoint=None, progress=None, fast=False, alias=None):
+    """
+    Copy every hit of ``source_search`` into ``target_index``.
+
+    The source is read with one scroll per shard (``preference=_shards:N``)
+    of ``batch_size`` hits per page, ``readers`` of them at a time (all
+    shards by default), and written by a bulk ``Queue`` sending
+    ``batch_size`` documents per request with up to ``writers`` requests in
+    flight. ``transform``, if given, is called with every raw hit and
+    returns the hit to index (it can change ``_source``, ``_id`` etc.) or
+    ``None`` to drop it.
+
+    ``progress`` is called with the statistics after every bulk request.
+    Documents elasticsearch rejects are counted as ``failed``, they don't
+    stop the copy. With a ``checkpoint`` file the shards copied completely
+    (without any failure) are recorded in it and skipped when the same
+    reindex is run again. ``fast`` turns off refresh and replicas on the
+    target (an index or an alias) for the duration of the copy, and
+    ``alias`` is moved over to ``target_index`` once everything is copied.
+
+    Returns the statistics: documents ``read``, ``written``, ``failed`` and
+    ``skipped`` by ``transform``, and the number of ``shards`` copied.
+    """
+    using = using or source_search._using
+    es = connections.get_connection(using)
+    source_es = connections.get_connection(source_search._using)
+    index = ','.join(source_search._index) if source_search._index else '_all'
+
+    done = _load_checkpoint(checkpoint)
+    shards = [s for s in range(_shard_count(source_es, index)) if s not in done]
+    stats = {'read': 0, 'written': 0, 'failed': 0, 'skipped': 0, 'shards': len(done)}
+    lock = threading.Lock()
+
+    def report(result):
+        with lock:
+            failed = len(result.items) if result.error is not None else len(result.errors)
+            stats['failed'] += failed
+            stats['written'] += len(result.items) - failed
+            if progress is not None:
+                progress(dict(stats))
+
+    queue = Queue(index=target_index, using=using, max_docs=batch_size, concurrency=writers,
+                  max_pending=batch_size * writers * 2, callback=report)
+
+    def copy(shard):
+        writes = _ShardWrites()
+        params = dict(source_search._params, preference='_shards:%d' % shard, scroll=scroll)
+        params.setdefault('size', batch_size)
+        for hit in _scan(source_es, query=source_search.to_dict(), index=source_search._index,
+                         doc_type=source_search._doc_type, params=params):
+            with lock:
+                stats['read'] += 1
+            if transform is not None:
+                hit = transform(hit)
+                if hit is None:
+                    with lock:
+                        stats['skipped'] += 1
+                    continue
+            doc = dict((k, hit[k]) for k in HIT_META_FIELDS if k in hit)
+            doc['_index'] = target_index
+            doc['_source'] = hit['_source']
+            action, source = expand_action(doc)
+            writes.add()
+            queue.append_encoded(serializer.dumps(action), serializer.dumps(source), target_index, writes)
+
+        # only wait for this shard's documents, failures are counted by
+        # report, and for this shard by writes
+        queue.send_soon(target_index)
+        writes.wait()
+        # only a shard whose every document made it can be skipped next time
+        if writes.failed:
+            return
+        with lock:
+            done.add(shard)
+            stats['shards'] += 1
+            if checkpoint is not None:
+                _save_checkpoint(checkpoint, done)
+
+    settings = _index_settings(es, target_index) if fast else None
+    if fast:
+        es.indices.put_settings(index=target_index,
+                                body={'index': {'refresh_interval': '-1', 'number_of_replicas': 0}})
+    pool = ThreadPool(readers or len(shards) or 1)
+    start = time.time()
+    try:
+        pool.map(copy, shards)
+    finally:
+        pool.close()
+        pool.join()
+        try:
+            queue.close()
+        except BulkError:
+            pass
+        if fast:
+            es.indices.put_settings(index=target_index, body={'index': settings})
+    connections.refresh(target_index, using=es)
+    logger.info('Copied %d document(s) from %s to %s in %.1fs.', stats['written'], index, target_index,
+                time.time() - start)
+
+    if alias is not None and not stats['failed']:
+        _swap_alias(es, alias, target_index)
+    return stats
@@ -1,6 +1,9 @@
+from fnmatch import fnmatch
+from functools import partial
+
 from elasticsearch import TransportError
 from retrying import retry
-from six import iteritems, string_types
+from six import iteritems, string_types, text_type
 
 from elasticsearch.helpers import scan
 
@@ -11,6 +14,80 @@ from .utils import DslBase, _count_search, _search, _scan
 from .result import Response, Result
 from .connections import connections
 
+def _as_list(clauses):
+    if clauses is None:
+        return []
+    return clauses if isinstance(clauses, list) else [clauses]
+
+
+def _routing_values(d, field):
+    """
+    Values ``field`` is restricted to by a ``term`` or ``terms`` clause that
+    every hit of ``d`` (a request body, query or filter as a dict) has to
+    match, ``None`` if there is no such clause.
+    """
+    if not isinstance(d, dict):
+        return None
+    for name, body in iteritems(d):
+        if name in ('term', 'terms') and field in body:
+            value = body[field]
+            if name == 'term':
+                return [value['value'] if isinstance(value, dict) else value]
+            # a terms lookup doesn't say which values
+            if isinstance(value, (list, tuple)):
+                return list(value)
+            continue
+        if name == 'query':
+            clauses = [body]
+        elif name == 'bool':
+            clauses = _as_list(body.get('must')) + _as_list(body.get('filter'))
+        elif name == 'and':
+            clauses = _as_list(body.get('filters') if isinstance(body, dict) else body)
+        elif name in ('filtered', 'constant_score'):
+            clauses = [body.get('query'), body.get('filter')]
+        else:
+            continue
+        for clause in clauses:
+            values = _routing_values(clause, field)
+            if values:
+                return values
+    return None
+
+
+class SourceFilter(object):
+    """
+    ``_source`` filtering of a search (see ``Search.only`` and
+    ``Search.defer``). Every response gets its own, handed to the document
+    classes with the hits, so that the documents left without some of their
+    fields can load them all together when one is first read.
+    """
+    # documents per mget when loading the fields left out
+    batch_size = 500
+
+    def __init__(self, include=(), exclude=(), using='default'):
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.using = using
+        # documents still without the fields left out
+        self.pending = []
+
+    def to_dict(self):
+        d = {}
+        if self.include:
+            d['include'] = self.include
+        if self.exclude:
+            d['exclude'] = self.exclude
+        return d
+
+    def left_out(self, names):
+        """
+        Which of the field ``names`` the hits don't include.
+        """
+        return [name for name in names
+                if self.include and not any(fnmatch(name, p) for p in self.include)
+                or any(fnmatch(name, p) for p in self.exclude)]
+
+
 class BaseProxy(object):
     """
     Simple proxy around DSL objects (queries and filters) that can be called
@@ -88,18 +165,22 @@ class Search(object):
     filter = ProxyDescriptor('filter')
     post_filter = ProxyDescriptor('post_filter')
 
-    def __init__(self, using='default', index=None, doc_type=None, extra=None):
+    def __init__(self, using='default', index=None, doc_type=None, extra=None, routing_field=None):
         """
         Search request to elasticsearch.
 
         :arg using: `Elasticsearch` instance to use
         :arg index: limit the search to index
         :arg doc_type: only query this type.
+        :arg routing_field: field documents are routed on, a search limited
+            to some of its values by a term or terms clause is only sent to
+            their shards (unless a ``routing`` param is given).
 
         All the paramters supplied (or omitted) at creation type can be later
         overriden by methods (`using`, `index` and `doc_type` respectively).
         """
         self._using = using
+        self._routing_field = routing_field
 
         self._index = None
         if isinstance(index, (tuple, list)):
@@ -126,6 +207,7 @@ class Search(object):
         self._highlight = {}
         self._highlight_opts = {}
         self._suggest = {}
+        self._source_filter = SourceFilter(using=using)
 
         self._query_proxy = ProxyQuery(self, 'query')
         self._filter_proxy = ProxyFilter(self, 'filter')
@@ -180,7 +262,7 @@ class Search(object):
         APIs.
         """
         s = self.__class__(using=self._using, index=self._index,
-                           doc_type=self._doc_type)
+                           doc_type=self._doc_type, routing_field=self._routing_field)
         s._doc_type_map = self._doc_type_map.copy()
         s._sort = self._sort[:]
         s._fields = self._fields[:] if self._fields is not None else None
@@ -188,6 +270,7 @@ class Search(object):
         s._highlight = self._highlight.copy()
         s._highlight_opts = self._highlight_opts.copy()
         s._suggest = self._suggest.copy()
+        s._source_filter = SourceFilter(self._source_filter.include, self._source_filter.exclude, self._using)
         for x in ('query', 'filter', 'post_filter'):
             getattr(s, x)._proxied = getattr(self, x)._proxied
 
@@ -266,6 +349,26 @@ class Search(object):
         s._fields = fields
         return s
 
+    def only(self, *fields):
+        """
+        Only load ``fields`` (names or wildcard patterns) from the
+        ``_source`` of each hit, replacing any previous ``only``. Documents
+        fetch the fields left out, for all the hits of a response at once,
+        when one of them is first read.
+        """
+        s = self._clone()
+        s._source_filter.include = list(fields)
+        return s
+
+    def defer(self, *fields):
+        """
+        Leave ``fields`` out of the ``_source`` of each hit, documents fetch
+        them when first read (see ``only``).
+        """
+        s = self._clone()
+        s._source_filter.exclude.extend(fields)
+        return s
+
     def sort(self, *keys):
         """
         Add sorting information to the search request. If called without
@@ -419,6 +522,9 @@ class Search(object):
             if self._fields is not None:
                 d['fields'] = self._fields
 
+            if self._source_filter.to_dict():
+                d['_source'] = self._source_filter.to_dict()
+
             if self._highlight:
                 d['highlight'] = {'fields': self._highlight}
                 d['highlight'].update(self._highlight_opts)
@@ -445,6 +551,31 @@ class Search(object):
         s._index = [index]
         return s
 
+    def _request_params(self):
+        """
+        Query params of the request, with the ``routing`` derived from the
+        query and filters when there is a ``routing_field``.
+        """
+        params = self._params
+        if self._routing_field is not None and 'routing' not in params:
+            values = _routing_values(self.to_dict(count=True), self._routing_field)
+            if values:
+                params = dict(params, routing=','.join(text_type(v) for v in values))
+        return params
+
+    def _callbacks(self):
+        """
+        Callbacks building the hits, the ones taking a ``source_filter``
+        (document classes) get one new ``SourceFilter`` when fields are left
+        out.
+        """
+        if not self._source_filter.to_dict():
+            return self._doc_type_map
+        source_filter = SourceFilter(self._source_filter.include, self._source_filter.exclude, self._using)
+        return dict((doc_type, partial(callback, source_filter=source_filter)
+                     if getattr(callback, 'takes_source_filter', False) else callback)
+                    for doc_type, callback in iteritems(self._doc_type_map))
+
     def count(self):
         """
         Return the number of hits matching the query and filters. Note that
@@ -454,7 +585,8 @@ class Search(object):
 
         d = self.to_dict(count=True)
         # TODO: failed shards detection
-        return _count_search(conn=es, index=self._index, doc_type=self._doc_type, body=d)['count']
+        return _count_search(conn=es, index=self._index, doc_type=self._doc_type, body=d,
+                             extra=self._request_params())['count']
 
     def execute(self):
         """
@@ -462,13 +594,19 @@ class Search(object):
         the data.
         """
         es = connections.get_connection(self._using)
-        resp = _search(conn=es, index=self._index, doc_type=self._doc_type, body=self.to_dict(), extra=self._params)
+        resp = _search(conn=es, index=self._index, doc_type=self._doc_type, body=self.to_dict(),
+                       extra=self._request_params())
         return Response(
             resp,
-            callbacks=self._doc_type_map
+            callbacks=self._callbacks()
         )
 
     def scan(self):
         es = connections.get_connection(self._using)
-        for hit in _scan(conn=es, query=self.to_dict(), index=self._index, doc_type=self._doc_type, params=self._params):
-            yield self._doc_type_map.get(hit['_type'], Result)(hit)
+        callbacks = self._callbacks()
+        for i, hit in enumerate(_scan(conn=es, query=self.to_dict(), index=self._index, doc_type=self._doc_type,
+                                      params=self._request_params())):
+            if i and not i % SourceFilter.batch_size:
+                # don't keep every document scanned waiting for its fields
+                callbacks = self._callbacks()
+            yield callbacks.get(hit['_type'], Result)(hit)
@@ -0,0 +1,141 @@
+import threading
+from collections import OrderedDict
+
+from elasticsearch_dsl.connections import connections
+from elasticsearch_dsl.exceptions import BulkError, ElasticsearchDslException
+from elasticsearch_dsl.queue import BatchResult, BulkItem
+from elasticsearch_dsl.utils import BULK_RETRY_STATUSES, _bulk
+
+__filename__ = 'session'
+
+_local = threading.local()
+
+
+def current_session():
+    """
+    Return the innermost ``Session`` open in the current thread, if any.
+    """
+    sessions = getattr(_local, 'sessions', None)
+    if sessions:
+        return sessions[-1]
+
+
+class Session(object):
+    """
+    Unit of work: inside ``with Session():`` every ``save`` and ``delete``
+    of any document class made in the current thread is only recorded, and
+    everything is sent when the block exits, in the order it was recorded,
+    in bulk requests of at most ``max_docs`` documents and ``max_bytes`` of
+    body, a new one starting whenever the connection (``using``, the
+    documents' own by default) changes. Nothing is sent if the block raises.
+
+    Items rejected by the cluster (429, 503) aren't sent again, they would
+    land after the writes recorded later: the commit stops at the first
+    request with a rejected item (or failing as a whole) and reports the
+    writes after it as not written. ``max_retries`` only applies to whole
+    requests.
+
+    Each document gets its outcome written back (id, version and index onto
+    its ``_meta``, ``_status`` and ``_error``) and ``commit`` raises
+    ``BulkError`` if any of them failed. Indices written with
+    ``refresh=True`` are refreshed once after the commit.
+    """
+    def __init__(self, using=None, max_retries=5, max_docs=None, max_bytes=None):
+        self.using = using
+        self.max_retries = max_retries
+        self.max_docs = max_docs or 100
+        self.max_bytes = max_bytes or 10 * 1024 * 1024
+        self._items = []
+        self._refresh = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __enter__(self):
+        if not hasattr(_local, 'sessions'):
+            _local.sessions = []
+        _local.sessions.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _local.sessions.remove(self)
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def add(self, document, index, refresh=False, **kwargs):
+        """
+        Record ``document``'s bulk action, any keyword arguments (``op_type``,
+        ``script``) are passed to its ``to_es``.
+        """
+        using = self.using or document._d.using
+        self._items.append((using, BulkItem.from_document(document, index, **kwargs)))
+        if refresh:
+            self._refresh[(using, index)] = True
+
+    def rollback(self):
+        """
+        Forget everything recorded since the last commit.
+        """
+        items, self._items = self._items, []
+        self._refresh.clear()
+        # let the documents know they were not written
+        error = ElasticsearchDslException('Session rolled back.')
+        BatchResult(None, [item for _, item in items], error=error).write_back()
+
+    def commit(self):
+        """
+        Send everything recorded and return a ``BatchResult`` per request
+        (and one for the writes left unsent if it stopped early).
+        """
+        items, self._items = self._items, []
+        refresh, self._refresh = self._refresh, OrderedDict()
+
+        results = []
+        batches = self._split(items)
+        for using, batch in batches:
+            result = BatchResult(None, batch)
+            try:
+                result.response = _bulk(conn=connections.get_connection(using), index=None, actions=batch,
+                                        timeout=60, expand_action_callback=lambda item: (item.action, item.source),
+                                        max_retries=self.max_retries, retry_rejected=False)
+            except Exception as e:
+                result.error = e
+            result.write_back()
+            results.append(result)
+            if result.error is not None or _rejected(result):
+                unsent = [item for _, rest in batches for item in rest]
+                if unsent:
+                    error = ElasticsearchDslException('Session commit stopped at a rejected write.')
+                    results.append(BatchResult(None, unsent, error=error))
+                    results[-1].write_back()
+                break
+
+        for using, index in refresh:
+            connections.refresh(index, using=using)
+
+        failed = [r for r in results if not r.ok]
+        if failed:
+            raise BulkError('%d of %d request(s) failed.' % (len(failed), len(results)), failed)
+        return results
+
+    def _split(self, items):
+        """
+        Split ``(using, item)`` pairs in order into ``(using, batch)`` that
+        each fit into one request.
+        """
+        current, batch, size = None, [], 0
+        for using, item in items:
+            if batch and (using != current or len(batch) == self.max_docs or size + item.size > self.max_bytes):
+                yield current, batch
+                batch, size = [], 0
+            current = using
+            batch.append(item)
+            size += item.size
+        if batch:
+            yield current, batch
+
+
+def _rejected(result):
+    return any(list(info.values())[0].get('status') in BULK_RETRY_STATUSES for _, info in result.errors)
@@ -0,0 +1,170 @@
+import json
+import os
+import threading
+
+__filename__ = 'spill'
+
+SEGMENT_NAME = 'segment-%010d.ndjson'
+
+
+class SegmentLog(object):
+    """
+    Append-only log of serialized bulk items kept as numbered NDJSON segment
+    files in ``path``.
+
+    Every record is one line ``{"index": ..., "action": ..., "source": ...}``
+    holding the already serialized action and source lines as they are. A
+    new segment is started once the current one reaches ``segment_bytes`` and
+    the file is fsynced every ``fsync_every`` records (and when rolling over
+    or closing). Records are read back in the order they were written and a
+    segment is deleted once it has been read completely and every record
+    read from it has been acknowledged.
+
+    Read positions are not persisted: after a restart every segment still on
+    disk is replayed from its beginning, so delivery is at least once.
+    """
+    def __init__(self, path, segment_bytes=64 * 1024 * 1024, fsync_every=1000):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.fsync_every = fsync_every
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self._segments = sorted(
+            int(name[8:-7]) for name in os.listdir(path)
+            if name.startswith('segment-') and name.endswith('.ndjson'))
+        self._unread = 0
+        for segment in self._segments:
+            with open(self._file(segment), 'rb') as f:
+                # a torn last line from a crash is skipped when reading
+                self._unread += sum(1 for line in f if line.strip() and line.endswith(b'\n'))
+
+        self._outstanding = {}
+        self._read_segment = self._segments[0] if self._segments else None
+        self._read_offset = 0
+        self._writer = None
+        self._write_segment = None
+        self._written = 0
+        self._unsynced = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """ Number of records written but not read yet. """
+        return self._unread
+
+    def _file(self, segment):
+        return os.path.join(self.path, SEGMENT_NAME % segment)
+
+    def _sync(self):
+        if self._writer is not None and self._unsynced:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self._unsynced = 0
+
+    def _roll(self):
+        self._sync()
+        if self._writer is not None:
+            self._writer.close()
+        # never append to a segment left over by a previous process
+        self._write_segment = (self._segments[-1] + 1) if self._segments else 0
+        self._segments.append(self._write_segment)
+        self._writer = open(self._file(self._write_segment), 'ab')
+        self._written = 0
+        if self._read_segment is None:
+            self._read_segment, self._read_offset = self._write_segment, 0
+
+    def append(self, index, action, source=None):
+        line = '{"index": %s, "action": %s, "source": %s}\n' % (
+            json.dumps(index), action, source if source is not None else 'null')
+        line = line.encode('utf-8')
+        with self._lock:
+            if self._writer is None or self._written >= self.segment_bytes:
+                self._roll()
+            self._writer.write(line)
+            self._written += len(line)
+            self._unread += 1
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every:
+                self._sync()
+
+    def read(self, max_bytes):
+        """
+        Return the next unread records, about ``max_bytes`` of them (at least
+        one if there is any), as ``(segment, index, action, source)`` tuples
+        where ``action`` and ``source`` are parsed JSON.
+        """
+        records, size = [], 0
+        with self._lock:
+            if self._writer is not None:
+                # make what we wrote visible to the reader below
+                self._writer.flush()
+            while self._unread and (not records or size < max_bytes):
+                segment = self._read_segment
+                full = False
+                with open(self._file(segment), 'rb') as f:
+                    f.seek(self._read_offset)
+                    for line in f:
+                        if not line.endswith(b'\n'):
+                            # torn write, the rest of the segment is unusable
+                            break
+                        self._read_offset += len(line)
+                        if not line.strip():
+                            continue
+                        record = json.loads(line.decode('utf-8'))
+                        records.append((segment, record['index'], record['action'], record['source']))
+                        self._outstanding[segment] = self._outstanding.get(segment, 0) + 1
+                        self._unread -= 1
+                        size += len(line)
+                        if size >= max_bytes:
+                            full = True
+                            break
+                if full or segment == self._write_segment:
+                    break
+                self._next_segment()
+        return records
+
+    def _next_segment(self):
+        current = self._read_segment
+        later = [s for s in self._segments if s > current]
+        self._read_segment = later[0] if later else None
+        self._read_offset = 0
+        self._truncate(current)
+
+    def _truncate(self, segment):
+        """ Delete ``segment`` if it's fully read and acknowledged. """
+        if self._outstanding.get(segment) or segment in (self._read_segment, self._write_segment):
+            return
+        self._outstanding.pop(segment, None)
+        self._segments.remove(segment)
+        os.remove(self._file(segment))
+
+    def _reset_if_drained(self):
+        """ Drop every segment once all records have been delivered. """
+        if self._unread or any(self._outstanding.values()):
+            return
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        for segment in self._segments:
+            os.remove(self._file(segment))
+        self._segments = []
+        self._outstanding = {}
+        self._read_segment = self._write_segment = None
+        self._read_offset = self._unsynced = 0
+
+    def ack(self, segment, count=1):
+        """ Mark ``count`` records read from ``segment`` as delivered. """
+        with self._lock:
+            self._outstanding[segment] -= count
+            if segment in self._segments:
+                self._truncate(segment)
+            self._reset_if_drained()
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self._write_segment = None
+            self._reset_if_drained()
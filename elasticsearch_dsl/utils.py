@@ -1,11 +1,15 @@
 from __future__ import unicode_literals
+import random
 import re
-from elasticsearch import TransportError
-from elasticsearch.helpers import bulk, scan, BulkIndexError
+import time
+from elasticsearch import TransportError, ConnectionError
+from elasticsearch.helpers import scan, expand_action
 from retrying import retry
 
-from six import iteritems, add_metaclass
+from six import iteritems, add_metaclass, text_type
 from six.moves import map
+from six.moves.urllib.parse import quote_plus
+from .connections import BufferSerializer
 from .exceptions import UnknownDslObject
 
 
@@ -449,8 +453,6 @@ def retry_if_valid_exception(e):
         status = e.status_code
         if status is TIMEOUT or 400 < status < 410:
             _retry = False
-    elif isinstance(e, BulkIndexError):
-        _retry = True
     else:
         _retry = False
     return _retry
@@ -462,6 +464,11 @@ def _save_document(conn, index, doc_type, body, extra):
     return conn.index(index=index, doc_type=doc_type, body=body, **extra)
 
 
+@retry(stop_max_attempt_number=5, wait_fixed=3000, retry_on_exception=retry_if_valid_exception)
+def _update_document(conn, index, doc_type, body, extra):
+    return conn.update(index=index, doc_type=doc_type, body=body, **extra)
+
+
 @retry(stop_max_attempt_number=5, wait_fixed=3000, retry_on_exception=retry_if_valid_exception)
 def _delete_document(conn, index, doc_type, extra):
     return conn.delete(index=index, doc_type=doc_type, **extra)
@@ -477,9 +484,120 @@ def _drop_index(conn, index):
     return conn.indices.delete(index)
 
 
-@retry(wait_fixed=60000, retry_on_exception=retry_if_valid_exception)
-def _bulk(conn, index, actions, chunk_size, timeout):
-    return bulk(client=conn, index=index, actions=actions, chunk_size=chunk_size, timeout=timeout)
+# bulk item (or whole request) statuses worth sending again
+BULK_RETRY_STATUSES = frozenset((429, 503))
+
+
+def _is_retryable_bulk_error(e):
+    return isinstance(e, ConnectionError) or getattr(e, 'status_code', None) in BULK_RETRY_STATUSES
+
+
+def _backoff(attempt, initial_backoff, max_backoff):
+    """
+    Exponential backoff with full jitter for the given (1 based) retry.
+    """
+    return random.uniform(0, min(max_backoff, initial_backoff * 2 ** (attempt - 1)))
+
+
+def _expand_actions(serializer, actions, expand_action_callback):
+    lines = []
+    for action, data in map(expand_action_callback, actions):
+        lines.append((serializer.dumps(action), serializer.dumps(data) if data is not None else None))
+    return lines
+
+
+def _send_bulk_body(conn, body, index=None, **params):
+    """
+    Send an already encoded bulk ``body`` (``bytes`` or a ``bytearray``)
+    through the client's transport, as is if its serializer is a
+    ``BufferSerializer`` (those of ``connections`` are) and as a copy
+    through ``Elasticsearch.bulk`` otherwise.
+    """
+    if not isinstance(conn.transport.serializer, BufferSerializer):
+        return conn.bulk(bytes(body), index=index, **params)
+    if index:
+        path = '/%s/_bulk' % quote_plus(index.encode('utf-8') if isinstance(index, text_type) else index, b',*')
+    else:
+        path = '/_bulk'
+    params = dict((k, text_type(v).lower() if isinstance(v, bool) else text_type(v)) for k, v in params.items())
+    _, data = conn.transport.perform_request('POST', path, params=params, body=body)
+    return data
+
+
+def _bulk(conn, index, actions, timeout, expand_action_callback=expand_action,
+          max_retries=5, initial_backoff=1, max_backoff=60, on_response=None, body=None, retry_rejected=True,
+          **kwargs):
+    """
+    Send ``actions`` in a single bulk request and return a list with one
+    ``(ok, {op_type: item})`` tuple per action, in order.
+
+    Only the items rejected with a retryable status (429, 503) are sent again,
+    with exponential backoff and jitter, up to ``max_retries`` times; anything
+    else is reported back as failed right away. The whole request is retried
+    the same way on connection errors and 429/503 responses. With
+    ``retry_rejected=False`` rejected items are reported back as failed too.
+
+    ``on_response``, if given, is called after every request sent with the
+    number of items in it, the time it took and the number of rejected items.
+
+    ``body`` can carry the already encoded request for all of ``actions``, it
+    is then sent as is, without any copy, and ``actions`` only get expanded
+    if some of them have to be sent again.
+    """
+    serializer = conn.transport.serializer
+    lines = None
+    if body is None:
+        lines = _expand_actions(serializer, actions, expand_action_callback)
+        count = len(lines)
+    else:
+        count = len(actions)
+
+    results = [None] * count
+    pending = list(range(count))
+    attempt = 0
+    while pending:
+        if attempt:
+            time.sleep(_backoff(attempt, initial_backoff, max_backoff))
+        if body is None or len(pending) < count:
+            if lines is None:
+                lines = _expand_actions(serializer, actions, expand_action_callback)
+            request = []
+            for i in pending:
+                request.extend(l for l in lines[i] if l is not None)
+            request = '\n'.join(request) + '\n'
+        else:
+            request = body
+
+        start = time.time()
+        try:
+            if request is body:
+                resp = _send_bulk_body(conn, body, index=index, timeout=timeout, **kwargs)
+            else:
+                resp = conn.bulk(request, index=index, timeout=timeout, **kwargs)
+        except TransportError as e:
+            retryable = _is_retryable_bulk_error(e)
+            if on_response is not None:
+                on_response(len(pending), time.time() - start, len(pending) if retryable else 0)
+            if attempt >= max_retries or not retryable:
+                raise
+            attempt += 1
+            continue
+
+        retry = []
+        for i, item in zip(pending, resp['items']):
+            op_type, info = item.popitem()
+            status = info.get('status', 500)
+            results[i] = (200 <= status < 300, {op_type: info})
+            if status in BULK_RETRY_STATUSES:
+                retry.append(i)
+        if on_response is not None:
+            on_response(len(pending), time.time() - start, len(retry))
+
+        if attempt >= max_retries or not retry_rejected:
+            break
+        pending = retry
+        attempt += 1
+    return results
 
 
 @retry(wait_exponential_multiplier=4000, wait_exponential_max=60000, retry_on_exception=retry_if_valid_exception)
@@ -498,11 +616,12 @@ def _search(conn, index, doc_type, body, extra):
 
 
 @retry(wait_exponential_multiplier=4000, wait_exponential_max=60000, retry_on_exception=retry_if_valid_exception)
-def _count_search(conn, index, doc_type, body):
+def _count_search(conn, index, doc_type, body, extra=None):
     return conn.count(
         index=index,
         doc_type=doc_type,
-        body=body)
+        body=body,
+        **(extra or {}))
 
 
 @retry(wait_exponential_multiplier=4000, wait_exponential_max=60000, retry_on_exception=retry_if_valid_exception)
@@ -512,4 +631,5 @@ def _scan(conn, query, index, doc_type, params):
         query=query,
         index=index,
         doc_type=doc_type,
+        **params
     )
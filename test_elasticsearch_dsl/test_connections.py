@@ -1,9 +1,17 @@
-from elasticsearch import Elasticsearch
+import gzip
+import io
+import threading
+import time
+
+from elasticsearch import Elasticsearch, Urllib3HttpConnection
+from mock import Mock, patch
 
 from elasticsearch_dsl import connections
 
 from pytest import raises
 
+from elasticsearch_dsl.connections import CompressedConnection
+
 def test_default_connection_is_returned_by_default():
     c = connections.Connections()
 
@@ -61,3 +69,117 @@ def test_create_connection_constructs_client():
 
     con = c.get_connection('testing')
     assert [{'host': 'es.com'}] == con.transport.hosts
+
+def test_transport_passes_bytearray_bodies_through_as_is():
+    c = connections.Connections()
+    c.configure(default={'hosts': ['es.com']})
+    transport = c.get_connection().transport
+    node = transport.get_connection()
+    node.perform_request = Mock(return_value=(200, {}, '{}'))
+    body = bytearray(b'{"delete": {"_id": 1}}\n')
+
+    transport.perform_request('POST', '/_bulk', body=body)
+
+    assert node.perform_request.call_args[0][3] is body
+
+def test_compress_option_picks_compressed_connection():
+    c = connections.Connections()
+    c.configure(default={'hosts': ['es.com'], 'compress': 512})
+
+    conn = c.get_connection().transport.get_connection()
+    assert isinstance(conn, CompressedConnection)
+    assert 512 == conn.compress_min_size
+    assert 'gzip,deflate' == conn.headers['accept-encoding']
+
+def test_compressed_connection_gzips_large_bodies_only():
+    conn = CompressedConnection(compress_min_size=10)
+    urlopen = conn.pool.urlopen = Mock()
+    urlopen.return_value.status = 200
+    urlopen.return_value.data = b'{}'
+
+    conn.perform_request('GET', '/_search', body=b'{}')
+    args, kwargs = urlopen.call_args
+    assert ('GET', '/_search', b'{}') == args
+    assert 'content-encoding' not in kwargs['headers']
+
+    body = bytearray(b'{"index": {}}\n{"title": "Hello"}\n' * 10000)
+    conn.perform_request('POST', '/_bulk', body=body)
+    args, kwargs = urlopen.call_args
+    assert 'gzip' == kwargs['headers']['content-encoding']
+    assert 'gzip,deflate' == kwargs['headers']['accept-encoding']
+    assert len(args[2]) < len(body) / 10
+    assert body == gzip.GzipFile(fileobj=io.BytesIO(args[2])).read()
+    assert 'content-encoding' not in conn.headers
+
+def test_compressed_connection_logs_the_original_body():
+    conn = CompressedConnection(compress_min_size=10)
+    conn.pool.urlopen = Mock()
+    conn.pool.urlopen.return_value.status = 200
+    conn.pool.urlopen.return_value.data = b'{}'
+
+    with patch.object(Urllib3HttpConnection, 'log_request_success') as log_request_success:
+        conn.perform_request('POST', '/_bulk', body=b'{"index": {}}\n{"title": "Hello"}\n')
+    assert b'{"index": {}}\n{"title": "Hello"}\n' == log_request_success.call_args[0][3]
+
+def test_compress_size_is_only_passed_to_compressed_connections():
+    class MyConnection(Urllib3HttpConnection):
+        pass
+
+    c = connections.Connections()
+    c.configure(default={'hosts': ['es.com'], 'compress': 512, 'connection_class': MyConnection})
+
+    assert isinstance(c.get_connection().transport.get_connection(), MyConnection)
+
+def test_concurrent_refreshes_of_an_index_are_merged():
+    c = connections.Connections()
+    client = Mock()
+    release = threading.Event()
+    client.indices.refresh.side_effect = lambda index: release.wait() or {'index': index}
+    c.add_connection('default', client)
+
+    threads = [threading.Thread(target=c.refresh, args=('blog', )) for _ in range(10)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join()
+
+    # the first one in flight, all the others wait for the next
+    assert 2 == client.indices.refresh.call_count
+
+def test_refreshes_of_an_index_are_spaced_by_min_interval():
+    c = connections.Connections()
+    client = Mock()
+    c.add_connection('default', client)
+    c.refresher.min_interval = 0.2
+
+    start = time.time()
+    c.refresh('blog')
+    c.refresh(['blog'])
+    c.refresh('other')
+
+    assert 3 == client.indices.refresh.call_count
+    assert 0.2 <= time.time() - start < 0.4
+
+def test_refresh_times_are_forgotten_once_min_interval_has_passed():
+    c = connections.Connections()
+    c.add_connection('default', Mock())
+    c.refresher.min_interval = 0.01
+
+    for index in ('a', 'b', 'c'):
+        c.refresh(index)
+    time.sleep(0.02)
+    c.refresh('d')
+
+    assert [('default', 'd')] == list(c.refresher._started)
+
+def test_refresh_errors_are_raised_to_every_caller():
+    c = connections.Connections()
+    client = Mock()
+    client.indices.refresh.side_effect = ValueError('boom')
+    c.add_connection('default', client)
+
+    for _ in range(2):
+        with raises(ValueError):
+            c.refresh('blog')
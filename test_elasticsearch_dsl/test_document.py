@@ -1,7 +1,18 @@
 import datetime
+import json
+import pickle
+import threading
 
-from elasticsearch_dsl.document import BaseDocument, BulkInsert
+from elasticsearch import NotFoundError
+from elasticsearch.serializer import JSONSerializer
+from mock import Mock
+from pytest import raises
+
+from elasticsearch_dsl.connections import connections
+from elasticsearch_dsl.document import STATE_SLOTS, BaseDocument, BulkInsert, Document
+from elasticsearch_dsl.exceptions import BulkError, ValidationError
 from elasticsearch_dsl.fields import *
+from elasticsearch_dsl.queue import BulkItem, Queue
 class   MyDoc(BaseDocument):
     title = StringField(index='analyzed')
     name = StringField()
@@ -120,6 +131,326 @@ def test_document_count():
 #     } == MyMultiSubDoc._doc_type.mapping.to_dict()
 
 
+class Post(Document):
+    title = StringField()
+    body = StringField()
+
+    meta = {
+        'index': 'blog',
+        'using': 'mock',
+    }
+
+
+def _bulk_lines(doc, **kwargs):
+    item = BulkItem.from_document(doc, 'blog', **kwargs)
+    return json.loads(item.action), item.source and json.loads(item.source)
+
+def test_field_values_are_kept_in_slots():
+    p = TenantPost(id=42, title='Hello', body='World', tenant_id='acme')
+    p.views = 3
+
+    assert not hasattr(p, '__dict__')
+    assert isinstance(TenantPost.title, StringField)
+    assert {'title': 'Hello', 'body': 'World', 'tenant_id': 'acme', 'views': 3} == p.to_dict()
+    copy = pickle.loads(pickle.dumps(p))
+    assert (42, p.to_dict()) == (copy.id, copy.to_dict())
+    del p.views
+    assert not hasattr(p, 'views')
+
+def test_generated_methods_match_the_generic_ones():
+    class Custom(TenantPost):
+        def to_dict(self):
+            return dict(super(Custom, self).to_dict(), custom=True)
+
+    p = TenantPost(id=42, title='Hello', tenant_id='acme', _index='blog')
+    generic = [getattr(TenantPost, m).__func__.generic for m in ('__init__', 'to_dict', 'validate')]
+    q = TenantPost.__new__(TenantPost)
+    generic[0](q, id=42, title='Hello', tenant_id='acme', _index='blog')
+
+    assert '<TenantPost fast paths>' == TenantPost.validate.__func__.__code__.co_filename
+    assert (generic[1](q), q._meta.to_dict()) == (p.to_dict(), p._meta.to_dict())
+    assert [value for _, value in STATE_SLOTS] == [getattr(p, name) for name, _ in STATE_SLOTS] == \
+        [getattr(q, name) for name, _ in STATE_SLOTS]
+    with raises(ValidationError) as generated_error:
+        p.validate()
+    with raises(ValidationError) as generic_error:
+        generic[2](p)
+    assert 'body field must be string' == str(generated_error.value) == str(generic_error.value)
+    # only the fields named, undeclared ones are skipped
+    p.validate(['title', 'tenant_id', 'views'])
+    with raises(ValidationError):
+        p.validate(['body'])
+    # overrides are kept and reach the generic implementation through super
+    assert {'title': 'Hello', 'body': None, 'tenant_id': 'acme', 'custom': True} == Custom(**p.to_dict()).to_dict()
+
+def test_class_queue_is_only_built_on_first_use(tmpdir):
+    class Spilled(Post):
+        meta = {'bulk_spill_dir': str(tmpdir)}
+
+    assert [] == tmpdir.listdir()
+    queue = Spilled._queue
+    assert queue is Spilled._queue
+    assert [tmpdir.join('spilled')] == tmpdir.listdir()
+    assert queue is not Post._queue
+    queue.close()
+
+def test_to_es_produces_bulk_action_for_each_operation():
+    p = Post(id=42, title='Hello')
+
+    assert ({'index': {'_id': 42, '_type': 'post', '_index': 'blog'}},
+            {'title': 'Hello', 'body': None}) == _bulk_lines(p)
+    assert ({'create': {'_id': 42, '_type': 'post', '_index': 'blog'}},
+            {'title': 'Hello', 'body': None}) == _bulk_lines(p, op_type='create')
+    assert ({'update': {'_id': 42, '_type': 'post', '_index': 'blog'}},
+            {'doc': {'title': 'Hello'}}) == _bulk_lines(p, op_type='update')
+    assert ({'update': {'_id': 42, '_type': 'post', '_index': 'blog'}},
+            {'doc': {'title': 'Hello'}, 'doc_as_upsert': True}) == _bulk_lines(p, op_type='upsert')
+    assert ({'update': {'_id': 42, '_type': 'post', '_index': 'blog'}},
+            {'script': 'ctx._source.views += 1', 'upsert': {'title': 'Hello', 'body': None}}) == \
+        _bulk_lines(p, op_type='upsert', script='ctx._source.views += 1')
+    assert ({'delete': {'_id': 42, '_type': 'post', '_index': 'blog'}}, None) == _bulk_lines(p, op_type='delete')
+
+def test_save_and_delete_queue_the_requested_operation(monkeypatch):
+    connections.add_connection('mock', Mock())
+    queued = []
+    monkeypatch.setattr(Post._queue, 'append', lambda doc, index, **kwargs: queued.append((index, kwargs)))
+    p = Post(id=42, title='Hello', body='World')
+
+    assert p.save(bulk=True, op='update')
+    assert p.delete(bulk=True)
+    assert [('blog', {'op_type': 'update', 'script': None}), ('blog', {'op_type': 'delete'})] == queued
+
+    with raises(ValueError):
+        p.save(bulk=True, op='replace')
+
+class Product(Post):
+    price = DecimalField()
+
+def test_save_update_sends_partial_document():
+    client = Mock()
+    client.update.return_value = {'_id': '42', '_version': 2}
+    connections.add_connection('mock', client)
+    p = Product(id=42, title='Hello', body='World')
+
+    assert p.price is None
+    assert not p.save(op='upsert')
+    # the unset price is left alone
+    client.update.assert_called_once_with(index='blog', doc_type='product', id=42,
+                                          body={'doc': {'title': 'Hello', 'body': 'World'}, 'doc_as_upsert': True})
+    assert 2 == p._meta.version
+
+def test_partial_save_only_sends_changed_fields(monkeypatch):
+    client = Mock()
+    client.update.return_value = {'_id': '42', '_version': 2}
+    client.index.return_value = {'_id': '7', 'created': True}
+    connections.add_connection('mock', client)
+    p = Post.from_es({'_index': 'blog', '_type': 'post', '_id': '42', '_source': {'title': 'Hello', 'body': 'World'}})
+
+    assert p.save(partial=True) is False
+    p.title = 'Bye'
+    p.save(partial=True)
+    client.update.assert_called_once_with(index='blog', doc_type='post', id='42', body={'doc': {'title': 'Bye'}})
+    assert p.save(partial=True) is False
+    # never loaded, written whole
+    Post(id=7, title='New', body='Post').save(partial=True)
+    assert 1 == client.index.call_count
+
+    queued = []
+    monkeypatch.setattr(Post._queue, 'append', lambda doc, index, **kwargs: queued.append(kwargs))
+    p.body = 'Everyone'
+    assert p.save(bulk=True, partial=True)
+    assert [{'op_type': 'update', 'script': None, 'fields': ['body']}] == queued
+    assert {'doc': {'body': 'Everyone'}} == p._update_body('update', fields=['body'])
+    # a failed write keeps the changes for the next save
+    p._update_from_bulk(False, {'status': 500, 'error': 'boom'})
+    p.save(bulk=True, partial=True)
+    assert ['body'] == queued[-1]['fields']
+
+def test_save_refresh_goes_through_the_refresh_coordinator(monkeypatch):
+    client = Mock()
+    client.index.return_value = {'_id': '42', 'created': True}
+    connections.add_connection('mock', client)
+    refreshed = []
+    monkeypatch.setattr(connections.refresher, 'refresh', lambda index, using: refreshed.append((index, using)))
+
+    Post(id=42, title='Hello', body='World').save(refresh=True)
+
+    client.index.assert_called_once_with(index='blog', doc_type='post', id=42, body={'title': 'Hello', 'body': 'World'})
+    assert [('blog', 'mock')] == refreshed
+
+def test_deferred_fields_are_fetched_together_on_first_access():
+    client = Mock()
+    client.search.return_value = {'hits': {'total': 2, 'hits': [
+        {'_index': 'blog', '_type': 'post', '_id': str(i), '_source': {'title': 'Post %d' % i}} for i in (1, 2)]}}
+    client.mget.return_value = {'docs': [
+        {'_index': 'blog', '_type': 'post', '_id': str(i), 'found': True, '_source': {'body': 'Body %d' % i}}
+        for i in (1, 2)]}
+    connections.add_connection('mock', client)
+    s = Post.query.defer('body')
+
+    assert {'exclude': ['body']} == s.to_dict()['_source']
+    assert {'include': ['title']} == Post.query.only('title').to_dict()['_source']
+    first, second = s.execute()
+    assert 'Post 1' == first.title
+    assert not client.mget.called
+    assert ('Body 2', 'Body 1') == (second.body, first.body)
+    client.mget.assert_called_once_with(body={'docs': [{'_index': 'blog', '_type': 'post', '_id': '1'},
+                                                       {'_index': 'blog', '_type': 'post', '_id': '2'}]},
+                                        _source_include=['body'])
+    assert {'title': 'Post 1', 'body': 'Body 1'} == first.to_dict()
+
+def test_deferred_fields_of_a_document_no_longer_found_raise_not_found():
+    client = Mock()
+    client.search.return_value = {'hits': {'total': 1, 'hits': [
+        {'_index': 'blog', '_type': 'post', '_id': '1', '_source': {'title': 'Post 1'}}]}}
+    client.mget.return_value = {'docs': [{'_index': 'blog', '_type': 'post', '_id': '1', 'found': False}]}
+    connections.add_connection('mock', client)
+    post, = Post.query.defer('body').execute()
+
+    with raises(NotFoundError):
+        post.body
+    with raises(NotFoundError):
+        post.body
+    assert 1 == client.mget.call_count
+    assert 'Post 1' == post.title
+    post.body = 'Rewritten'
+    assert {'title': 'Post 1', 'body': 'Rewritten'} == post.to_dict()
+
+def test_partial_save_of_a_deferred_hit_leaves_the_deferred_fields_alone():
+    client = Mock()
+    client.search.return_value = {'hits': {'total': 1, 'hits': [
+        {'_index': 'blog', '_type': 'post', '_id': '1', '_source': {'title': 'Post 1'}}]}}
+    client.update.return_value = {'_id': '1', '_version': 2}
+    connections.add_connection('mock', client)
+    post, = Post.query.defer('body').execute()
+
+    post.title = 'New title'
+    post.save(partial=True)
+
+    client.update.assert_called_once_with(index='blog', doc_type='post', id='1', body={'doc': {'title': 'New title'}})
+    assert 0 == client.mget.call_count
+
+class TenantPost(Post):
+    tenant_id = StringField()
+
+    meta = {
+        'routing_field': 'tenant_id',
+    }
+
+class CountingField(StringField):
+    converted = 0
+
+    def to_python(self, value):
+        CountingField.converted += 1
+        return super(CountingField, self).to_python(value)
+
+class LazyPost(Post):
+    author = CountingField()
+
+    meta = {
+        'lazy': True,
+    }
+
+def test_lazy_documents_convert_fields_on_first_access():
+    hit = {'_index': 'blog', '_type': 'lazy_post', '_id': '42', '_version': 3,
+           '_source': {'title': 'Hello', 'body': 'World', 'author': 'honza'}}
+    CountingField.converted = 0
+    p = LazyPost.from_es(hit)
+
+    assert ('42', 3, 0) == (p.id, p._meta.version, CountingField.converted)
+    assert {'title': 'Hello', 'body': 'World', 'author': 'honza'} == p.to_dict()
+    assert 0 == CountingField.converted
+    assert ('honza', 'honza') == (p.author, p.author)
+    assert 1 == CountingField.converted
+    p.title = 'Bye'
+    assert {'title': 'Bye', 'body': 'World', 'author': 'honza'} == p.to_dict()
+
+def test_routing_is_derived_from_the_routing_field():
+    client = Mock()
+    client.index.return_value = {'_id': '42', 'created': True}
+    client.get.return_value = {'_index': 'blog', '_type': 'tenant_post', '_id': '42',
+                               '_source': {'title': 'Hello', 'body': 'World', 'tenant_id': 'acme'}}
+    connections.add_connection('mock', client)
+    p = TenantPost(id=42, title='Hello', body='World', tenant_id='acme')
+
+    p.save()
+    client.index.assert_called_once_with(index='blog', doc_type='tenant_post', id=42, routing='acme',
+                                         body={'title': 'Hello', 'body': 'World', 'tenant_id': 'acme'})
+    assert 'acme' == json.loads(BulkItem.from_document(p, 'blog').action)['index']['_routing']
+    assert 'acme' == TenantPost.get(42, tenant_id='acme').tenant_id
+    client.get.assert_called_once_with(index='blog', doc_type='tenant_post', id=42, routing='acme')
+    assert {'routing': 'acme'} == TenantPost.query.filter('term', tenant_id='acme')._request_params()
+
+def test_bulk_insert_sessions_are_private_to_their_thread(monkeypatch):
+    client = Mock()
+    client.index.return_value = {'_id': '99', 'created': True}
+    connections.add_connection('mock', client)
+    sent = []
+    monkeypatch.setattr(Queue, '_send', lambda self, index, batch: sent.append(
+        (index, [json.loads(item.action)['index']['_id'] for item in batch])))
+
+    def ingest(n):
+        with BulkInsert(Post, 'blog-%d' % n) as bulk:
+            for i in range(3):
+                Post(id=n * 10 + i, title='Hello', body='World').save()
+            assert 3 == len(bulk.queue)
+
+    threads = [threading.Thread(target=ingest, args=(n,)) for n in (1, 2)]
+    for t in threads:
+        t.start()
+    # outside of the sessions documents are saved right away
+    Post(id=99, title='Hello', body='World').save()
+    for t in threads:
+        t.join()
+
+    assert [('blog-1', [10, 11, 12]), ('blog-2', [20, 21, 22])] == sorted(sent)
+    assert 1 == client.index.call_count
+    assert 'blog' == Post._d.index
+    assert 0 == len(Post._queue)
+
+def test_bulk_insert_only_has_a_queue_while_entered(monkeypatch):
+    connections.add_connection('mock', Mock())
+    monkeypatch.setattr(Queue, '_send', Mock(side_effect=ValueError('cluster is down')))
+    bulk = BulkInsert(Post, 'blog-1')
+    assert bulk.queue is None
+
+    with raises(KeyError):
+        with bulk:
+            Post(id=1, title='Hello', body='World').save()
+            raise KeyError('original')
+    # the failed flush doesn't hide what went wrong in the block
+    assert 1 == Queue._send.call_count
+    assert bulk.queue is None
+
+    with raises(BulkError):
+        with bulk:
+            Post(id=1, title='Hello', body='World').save()
+
+def test_bulk_results_are_written_back_onto_the_documents():
+    client = Mock()
+    client.transport.serializer = JSONSerializer()
+    client.bulk.return_value = {'items': [
+        {'create': {'_index': 'blog', '_type': 'post', '_id': 'AU1x', '_version': 1, 'status': 201}},
+        {'index': {'_index': 'blog', '_type': 'post', '_id': '7', 'status': 400, 'error': 'MapperParsingException'}},
+    ]}
+    connections.add_connection('mock', client)
+    batches = []
+    queue = Post._d.make_queue(flush_interval=60, callback=batches.append)
+    new, broken = Post(title='Hello', body='World'), Post(id='7', title='Hello', body='World')
+    queue.append(new, 'blog', op_type='create')
+    queue.append(broken, 'blog')
+
+    with raises(BulkError):
+        queue.flush()
+
+    assert ('AU1x', 1, 201, None) == (new.id, new._meta.version, new._status, new._error)
+    assert (400, 'MapperParsingException') == (broken._status, broken._error)
+    # not elasticsearch metadata
+    assert {'id': 'AU1x', 'index': 'blog', 'version': 1} == new._meta.to_dict()
+    assert [[new, broken]] == [[item.document for item in b.items] for b in batches]
+    queue.close()
+
+
 if __name__ == "__main__":
     # test_declarative_mapping_definition()
     # test_document_can_be_created_dynamicaly()
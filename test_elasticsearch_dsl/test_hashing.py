@@ -0,0 +1,116 @@
+import datetime
+
+from mock import Mock
+
+from elasticsearch_dsl import document, hashing
+from elasticsearch_dsl.connections import connections
+from elasticsearch_dsl.document import Document
+from elasticsearch_dsl.fields import StringField
+from elasticsearch_dsl.hashing import HASH_FIELD, DiskHashCache, LRUHashCache, content_hash, hash_key
+from elasticsearch_dsl.queue import BulkItem
+
+
+class Product(Document):
+    name = StringField()
+    price = StringField()
+
+    meta = {
+        'index': 'products',
+        'using': 'hashing',
+        'content_hash': True,
+    }
+
+
+def test_content_hash_does_not_depend_on_key_order():
+    d = datetime.datetime(2015, 2, 1)
+    assert content_hash({'a': 1, 'b': [1, 2], 'c': d}) == content_hash({'c': d, 'b': [1, 2], 'a': 1})
+    assert content_hash({'a': 1}) != content_hash({'a': 2})
+
+def test_lru_hash_cache_forgets_least_recently_used():
+    cache = LRUHashCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert (1, None, 3) == (cache.get('a'), cache.get('b'), cache.get('c'))
+
+def test_disk_hash_cache_survives_reopening(tmpdir):
+    path = str(tmpdir.join('hashes'))
+    cache = DiskHashCache(path)
+    cache.set(hash_key('i', 't', 1), 'abc')
+    cache.close()
+
+    assert 'abc' == DiskHashCache(path).get(hash_key('i', 't', '1'))
+
+def test_disk_hash_caches_left_open_are_closed_on_exit(tmpdir):
+    path = str(tmpdir.join('hashes'))
+    cache = DiskHashCache(path)
+    cache.set(hash_key('i', 't', 1), 'abc')
+    hashing._close_caches()
+
+    assert cache not in hashing._open_caches
+    assert 'abc' == DiskHashCache(path).get(hash_key('i', 't', '1'))
+
+def test_hashes_are_remembered_under_the_index_saved_to():
+    client = Mock()
+    client.index.return_value = {'_index': 'products-2', '_type': 'product', '_id': '5', '_version': 1}
+    connections.add_connection('hashing', client)
+
+    Product(id=5, name='Mug', price='3').save(index='products-live')
+    assert not Product(id=5, name='Mug', price='3').save(index='products-live')
+    assert 1 == client.index.call_count
+
+def test_unchanged_documents_are_only_written_once():
+    client = Mock()
+    client.index.return_value = {'_index': 'products', '_type': 'product', '_id': '1', '_version': 1}
+    connections.add_connection('hashing', client)
+
+    Product(id=1, name='Book', price='10').save()
+    body = client.index.call_args[1]['body']
+    assert content_hash({'name': 'Book', 'price': '10'}) == body[HASH_FIELD]
+
+    assert not Product(id=1, name='Book', price='10').save()
+    Product(id=1, name='Book', price='12').save()
+    Product(id=1, name='Book', price='12').save(skip_unchanged=False)
+    assert 3 == client.index.call_count
+
+def test_hashes_come_from_fetched_documents_and_bulk_results(monkeypatch):
+    client = Mock()
+    client.mget.return_value = {'docs': [
+        {'_index': 'products', '_type': 'product', '_id': '7', 'found': True,
+         '_source': {HASH_FIELD: content_hash({'name': 'Pen', 'price': '1'})}},
+        {'_index': 'products', '_type': 'product', '_id': '8', 'found': False},
+    ]}
+    connections.add_connection('hashing', client)
+    Product.fetch_hashes([7, 8])
+    assert not Product(id=7, name='Pen', price='1').save()
+
+    queued = []
+    monkeypatch.setattr(Product._queue, 'append', lambda doc, index, **kwargs: queued.append(
+        BulkItem.from_document(doc, index, **kwargs)))
+    doc = Product(id=9, name='Ink', price='2')
+    assert doc.save(bulk=True)
+    assert doc.save(bulk=True)
+    doc._update_from_bulk(True, {'_index': 'products', '_id': '9', 'status': 201})
+    assert not doc.save(bulk=True)
+    assert 2 == len(queued)
+    assert HASH_FIELD in queued[0].source
+    assert not client.index.called
+
+def test_hash_is_mapped_unindexed_and_computed_once_per_save(monkeypatch):
+    assert {'type': 'string', 'index': 'no'} == \
+        Product._d.mapping.to_dict()['product']['properties'][HASH_FIELD]
+
+    client = Mock()
+    client.index.return_value = {'_index': 'products', '_type': 'product', '_id': '3', '_version': 1}
+    connections.add_connection('hashing', client)
+    hashed = []
+    monkeypatch.setattr(document, 'content_hash', lambda data: hashed.append(data) or content_hash(data))
+
+    doc = Product(id=3, name='Cup', price='4')
+    doc.save()
+
+    assert 1 == len(hashed)
+    assert content_hash({'name': 'Cup', 'price': '4'}) == client.index.call_args[1]['body'][HASH_FIELD]
+    assert doc._hash is None
@@ -0,0 +1,69 @@
+import json
+
+from elasticsearch_dsl.document import Document
+from elasticsearch_dsl.fields import StringField, IntField
+from elasticsearch_dsl.ingest import ingest, _encode_chunk, _encode_document
+
+from .test_queue import RecordingQueue
+
+
+class Event(Document):
+    name = StringField()
+    count = IntField(required=True)
+
+    meta = {
+        'index': 'events',
+    }
+
+
+class Venue(Document):
+    name = StringField()
+
+    meta = {
+        'index': 'venues',
+    }
+
+    def clean(self):
+        raise ValueError(u'Nom d\xe9j\xe0 pris')
+
+
+def test_ingest_encodes_in_worker_processes_and_keeps_input_order():
+    q = RecordingQueue(max_docs=1000, flush_interval=60)
+    docs = [{'id': i, 'name': 'event %d' % i, 'count': i + 1} for i in range(20)]
+    docs[5] = Event(id=5, name='event 5', count=6)
+
+    queued, errors = ingest(Event, docs, processes=2, chunk_size=3, queue=q)
+
+    assert (20, []) == (queued, errors)
+    assert [('events', list(range(20)))] == q.sent
+
+def test_ingest_reports_documents_failing_validation_by_position():
+    q = RecordingQueue(max_docs=1000, flush_interval=60)
+    docs = [{'name': 'ok', 'count': 1}, {'name': 'missing count'}, {'name': 'ok', 'count': 2},
+            {'name': 'not a count', 'count': 'x'}]
+
+    queued, errors = ingest(Event, docs, processes=1, chunk_size=2, queue=q, flush=False)
+
+    assert 2 == queued
+    assert [1, 3] == [position for position, _ in errors]
+    assert errors[1][1].startswith('ValueError: ')
+    item = q._queue['events'][1]
+    assert {'index': {'_type': 'event', '_index': 'events'}} == json.loads(item.action)
+    assert {'name': 'ok', 'count': 2} == json.loads(item.source)
+
+def test_meta_keys_of_input_dicts_go_to_meta_whatever_their_order():
+    for doc in ({'_id': 'e1', 'name': 'a', 'count': 1, '_routing': 'r'},
+                {'_routing': 'r', 'count': 1, 'name': 'a', '_id': 'e1'}):
+        action, source = _encode_document(Event, 'events', 'index', doc)
+
+        assert {'index': {'_id': 'e1', '_routing': 'r', '_type': 'event', '_index': 'events'}} == \
+            json.loads(action)
+        assert {'name': 'a', 'count': 1} == json.loads(source)
+
+    action, _ = _encode_document(Event, 'events', 'index', {'_id': 'e2', 'name': 'b', 'count': 2})
+    assert 'e2' == json.loads(action)['index']['_id']
+
+def test_non_ascii_error_messages_are_reported():
+    encoded, errors = _encode_chunk((Venue, 'venues', 'index', [{'name': 'a'}]))
+
+    assert ([], [(0, u'ValueError: Nom d\xe9j\xe0 pris')]) == (encoded, errors)
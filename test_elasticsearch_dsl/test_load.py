@@ -0,0 +1,64 @@
+import json
+
+from elasticsearch_dsl.load import _load_range, _ranges, _open_map, main
+
+from .test_ingest import Event, Venue
+from .test_queue import RecordingQueue
+
+
+def test_ranges_end_on_line_boundaries(tmpdir):
+    path = tmpdir.join('events.ndjson')
+    path.write('aaaa\nbb\ncccccc\nd')
+    mm = _open_map(str(path))
+
+    assert [(0, 5), (5, 8), (8, 15), (15, 16)] == list(_ranges(mm, 0, 3))
+    assert [(0, 16)] == list(_ranges(mm, 0, 100))
+
+def test_load_file_sends_valid_lines_in_order_and_dead_letters_the_rest(tmpdir):
+    path = tmpdir.join('events.ndjson')
+    lines = [json.dumps({'id': i, 'name': 'event %d' % i, 'count': i + 1}) for i in range(10)]
+    lines[3] = '{"id": 3, "name": '
+    lines[6] = json.dumps({'id': 6, 'name': 'no count'})
+    path.write('\n'.join(lines) + '\n\n')
+    dead_letter = tmpdir.join('rejected.ndjson')
+    q = RecordingQueue(max_docs=1000, flush_interval=60)
+    updates = []
+
+    stats = Event.load_file(str(path), processes=2, chunk_bytes=64, queue=q,
+                            dead_letter=str(dead_letter), progress=updates.append)
+
+    assert [('events', [0, 1, 2, 4, 5, 7, 8, 9])] == q.sent
+    assert {'bytes': path.size(), 'total': path.size(), 'loaded': 8, 'rejected': 2} == stats
+    assert len(updates) > 1
+    rejected = [json.loads(l) for l in dead_letter.readlines()]
+    assert [lines[3], lines[6]] == [r['line'] for r in rejected]
+    assert 'count' in rejected[1]['error']
+
+def test_load_csv_with_header(tmpdir):
+    path = tmpdir.join('events.csv')
+    path.write('name,count\n"first, event",1\nsecond,\nthird,3\n')
+    q = RecordingQueue(max_docs=1000, flush_interval=60)
+
+    stats = Event.load_file(str(path), processes=1, queue=q, flush=False)
+
+    assert (2, 1) == (stats['loaded'], stats['rejected'])
+    assert [{'name': 'first, event', 'count': 1}, {'name': 'third', 'count': 3}] == \
+        [json.loads(item.source) for item in q._queue['events']]
+
+def test_main_returns_error_status_when_lines_are_rejected(tmpdir, monkeypatch):
+    path = tmpdir.join('events.ndjson')
+    path.write('{"name": "no count"}\n')
+    q = RecordingQueue(max_docs=1000, flush_interval=60)
+    monkeypatch.setattr(Event, '_queue', q)
+
+    assert 1 == main(['test_elasticsearch_dsl.test_ingest:Event', str(path), '--processes', '1'])
+    assert [] == q.sent
+
+def test_non_ascii_errors_only_reject_their_line(tmpdir):
+    path = tmpdir.join('venues.ndjson')
+    path.write('{"name": "a"}\n{"name": "b"}\n')
+
+    encoded, rejected = _load_range((Venue, str(path), 'ndjson', None, 0, path.size(), 'venues', 'index'))
+
+    assert [] == encoded
+    assert [(0, u'{"name": "a"}', u'Nom d\xe9j\xe0 pris'), (14, u'{"name": "b"}', u'Nom d\xe9j\xe0 pris')] == rejected
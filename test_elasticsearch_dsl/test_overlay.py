@@ -0,0 +1,111 @@
+import time
+
+from elasticsearch import NotFoundError
+from mock import Mock
+from pytest import raises
+
+from elasticsearch_dsl.connections import connections
+from elasticsearch_dsl.document import Document
+from elasticsearch_dsl.fields import StringField
+from elasticsearch_dsl.overlay import Overlay
+from elasticsearch_dsl.session import Session
+
+
+class Note(Document):
+    title = StringField()
+    body = StringField()
+
+    meta = {
+        'index': 'notes',
+        'using': 'overlay',
+        'read_your_writes': Overlay(max_size=2, ttl=0.05),
+    }
+
+
+def test_overlay_merges_updates_and_expires_confirmed_writes():
+    overlay = Overlay(max_size=2, ttl=0.01)
+    overlay.put('a', {'x': 1, 'o': {'y': 1}})
+    overlay.update('a', {'o': {'z': 2}})
+    overlay.update('unknown', {'x': 1})
+
+    assert (True, {'x': 1, 'o': {'y': 1, 'z': 2}}) == overlay.get('a')
+    assert (False, None) == overlay.get('unknown')
+    overlay.written('a', overlay.update('a', {}))
+    time.sleep(0.02)
+    assert (False, None) == overlay.get('a')
+
+    for key in 'bcd':
+        overlay.put(key, None)
+    assert (False, None) == overlay.get('b')
+    assert (True, None) == overlay.get('d')
+
+def test_confirming_an_older_write_keeps_a_newer_one_pending():
+    overlay = Overlay(ttl=0.01)
+    first = overlay.put('a', {'x': 1})
+    second = overlay.put('a', {'x': 2})
+    overlay.written('a', first)
+    time.sleep(0.02)
+    assert (True, {'x': 2}) == overlay.get('a')
+
+    third = overlay.update('a', {'y': 1})
+    overlay.written('a', second)
+    time.sleep(0.02)
+    assert (True, {'x': 2, 'y': 1}) == overlay.get('a')
+    overlay.written('a', third)
+    time.sleep(0.02)
+    assert (False, None) == overlay.get('a')
+
+def test_failure_of_an_older_write_keeps_a_newer_one():
+    overlay = Overlay()
+    first = overlay.put('a', {'x': 1})
+    overlay.put('a', {'x': 2})
+    overlay.discard('a', first)
+    assert (True, {'x': 2}) == overlay.get('a')
+    overlay.discard('a')
+    assert (False, None) == overlay.get('a')
+
+def test_queued_writes_are_visible_to_get_and_search_hits(monkeypatch):
+    client = Mock()
+    client.indices.get_settings.return_value = {'notes': {}}
+    connections.add_connection('overlay', client)
+    monkeypatch.setattr(Note._queue, 'append', lambda doc, index, **kwargs: None)
+
+    Note(id=1, title='Hello', body='World').save(bulk=True)
+    Note(id=1, title='Hi', body='World').save(bulk=True, op='update')
+    assert ('Hi', 'World') == (Note.get(1).title, Note.get(1).body)
+    assert not client.get.called
+
+    hit = Note.from_es({'_index': 'notes', '_type': 'note', '_id': 1, '_source': {'title': 'Old', 'body': 'Old'}})
+    assert ('Hi', 'World') == (hit.title, hit.body)
+
+    Note(id=1).delete(bulk=True)
+    with raises(NotFoundError):
+        Note.get(1)
+
+def test_failed_and_rolled_back_writes_are_dropped():
+    client = Mock()
+    client.get.return_value = {'_index': 'notes', '_type': 'note', '_id': '2', '_source': {'title': 'Stored'}}
+    client.indices.get_settings.return_value = {'notes': {}}
+    connections.add_connection('overlay', client)
+
+    note = Note(id=2, title='Pending', body='Pending')
+    with raises(ValueError):
+        with Session():
+            note.save()
+            raise ValueError()
+
+    assert 'Stored' == Note.get(2).title
+    client.get.assert_called_once_with(index='notes', doc_type='note', id=2)
+
+def test_writes_through_an_alias_are_visible_to_hits_of_its_index(monkeypatch):
+    client = Mock()
+    client.indices.get_settings.return_value = {'notes-2': {}}
+    connections.add_connection('overlay', client)
+    monkeypatch.setattr(Note._queue, 'append', lambda doc, index, **kwargs: None)
+
+    Note(id=3, title='Aliased', body='Body').save(index='notes-live', bulk=True)
+
+    hit = Note.from_es({'_index': 'notes-2', '_type': 'note', '_id': 3, '_source': {'title': 'Old'}})
+    assert 'Aliased' == hit.title
+    assert 'Aliased' == Note.get(3, index='notes-live').title
+    client.indices.get_settings.assert_called_once_with(index='notes-live')
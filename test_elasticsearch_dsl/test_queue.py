@@ -0,0 +1,364 @@
+import json
+import threading
+import time
+
+from elasticsearch.serializer import JSONSerializer
+from mock import Mock
+from pytest import raises, warns
+
+from elasticsearch_dsl.connections import BufferSerializer, connections
+from elasticsearch_dsl.exceptions import BulkError
+from elasticsearch_dsl import queue
+from elasticsearch_dsl.queue import Queue, BulkItem, AdaptiveController, PackedBuffer
+
+
+class Doc(object):
+    def __init__(self, id, body=''):
+        self.id = id
+        self.body = body
+
+    def to_es(self):
+        return {'_id': self.id, '_type': 'doc', '_source': {'body': self.body}}
+
+
+class RecordingQueue(Queue):
+    def __init__(self, **kwargs):
+        # set up first, replaying a spill log starts sending right away
+        self.sent = []
+        self.release = threading.Event()
+        self.release.set()
+        super(RecordingQueue, self).__init__(**kwargs)
+
+    def _send(self, index, batch):
+        self.release.wait()
+        self.sent.append((index, [list(json.loads(item.action).values())[0].get('_id') for item in batch]))
+
+    def append(self, id, index='default', body=''):
+        super(RecordingQueue, self).append(Doc(id, body), index)
+
+
+def _wait_for(predicate, timeout=2.0):
+    end = time.time() + timeout
+    while time.time() < end:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return False
+
+def test_queue_flushes_in_background_once_limit_is_reached():
+    q = RecordingQueue(max_docs=3, flush_interval=60)
+    for i in range(3):
+        q.append(i, 'test-index')
+
+    assert _wait_for(lambda: q.sent)
+    assert [('test-index', [0, 1, 2])] == q.sent
+    assert _wait_for(lambda: 0 == len(q))
+
+def test_queue_flushes_old_documents_after_flush_interval():
+    q = RecordingQueue(max_docs=100, flush_interval=0.05)
+    q.append('doc', 'test-index')
+
+    assert _wait_for(lambda: q.sent)
+    assert [('test-index', ['doc'])] == q.sent
+
+def test_send_soon_makes_pending_documents_due_without_waiting():
+    q = RecordingQueue(max_docs=100, flush_interval=60)
+    q.append('a', 'test-index')
+    q.append('b', 'other-index')
+    q.send_soon('test-index')
+
+    assert _wait_for(lambda: q.sent)
+    assert [('test-index', ['a'])] == q.sent
+    assert 1 == len(q)
+
+def test_flush_sends_pending_documents_synchronously():
+    q = RecordingQueue(max_docs=100, flush_interval=60)
+    q.append(1, 'a')
+    q.append(2, 'b')
+    q.flush('a')
+
+    assert [('a', [1])] == q.sent
+    q.flush()
+    assert [('a', [1]), ('b', [2])] == q.sent
+    assert 0 == len(q)
+
+def test_concurrent_appends_are_all_sent_exactly_once():
+    q = RecordingQueue(max_docs=7, flush_interval=60)
+
+    def produce(n):
+        for i in range(100):
+            q.append(n * 1000 + i, "test-index")
+
+    threads = [threading.Thread(target=produce, args=(n, )) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    q.flush()
+
+    sent = [doc for _, batch in q.sent for doc in batch]
+    assert 800 == len(sent)
+    assert set(n * 1000 + i for n in range(8) for i in range(100)) == set(sent)
+
+def test_append_blocks_when_max_pending_is_reached():
+    q = RecordingQueue(max_docs=2, flush_interval=60, max_pending=2)
+    q.release.clear()
+    q.append(1, 'test-index')
+    q.append(2, 'test-index')
+
+    done = threading.Event()
+    def produce():
+        q.append(3, 'test-index')
+        done.set()
+    t = threading.Thread(target=produce)
+    t.start()
+
+    assert not done.wait(0.1)
+    q.release.set()
+    assert done.wait(2)
+    t.join()
+    q.flush()
+    assert [1, 2, 3] == [doc for _, batch in q.sent for doc in batch]
+
+def test_close_flushes_pending_documents():
+    q = RecordingQueue(max_docs=100, flush_interval=60)
+    q.append(1, 'test-index')
+    q.close()
+
+    assert [('test-index', [1])] == q.sent
+
+def test_failures_of_the_background_thread_are_raised_by_the_next_flush():
+    class FailingQueue(RecordingQueue):
+        def _send(self, index, batch):
+            super(FailingQueue, self)._send(index, batch)
+            raise ValueError('boom')
+
+    q = FailingQueue(max_docs=1, flush_interval=60)
+    q.append(1, 'test-index')
+    assert _wait_for(lambda: 0 == len(q))
+
+    with raises(BulkError) as e:
+        q.flush()
+    assert [[1]] == [[item.document.id for item in r.items] for r in e.value.errors]
+    # reported once
+    q.flush()
+    q.close()
+
+def test_closed_queue_is_not_kept_alive_until_exit():
+    q = RecordingQueue(max_docs=1, flush_interval=60)
+    q.append(1, 'test-index')
+    assert q in queue._open_queues
+    q.close()
+
+    assert q not in queue._open_queues
+
+def test_limit_is_a_deprecated_alias_of_max_docs():
+    with warns(DeprecationWarning):
+        q = RecordingQueue(limit=3, flush_interval=60)
+
+    assert 3 == q.max_docs == q.limit
+
+def test_bulk_item_is_serialized_on_creation():
+    item = BulkItem.from_document(Doc(42, 'hello'), 'test-index')
+
+    assert {'index': {'_id': 42, '_type': 'doc', '_index': 'test-index'}} == json.loads(item.action)
+    assert {'body': 'hello'} == json.loads(item.source)
+    assert len(item.action) + len(item.source) + 2 == item.size
+
+def test_queue_flushes_once_max_bytes_is_reached():
+    q = RecordingQueue(max_docs=100, max_bytes=200, flush_interval=60)
+    q.release.clear()
+    q.append(1, 'test-index', body='x' * 80)
+    q.append(2, 'test-index', body='x' * 80)
+    q.append(3, 'test-index', body='x' * 80)
+    q.release.set()
+
+    assert _wait_for(lambda: q.sent)
+    q.flush()
+    assert [('test-index', [1]), ('test-index', [2]), ('test-index', [3])] == q.sent
+
+def test_oversized_document_is_sent_on_its_own():
+    q = RecordingQueue(max_docs=100, max_bytes=200, flush_interval=60)
+    q.release.clear()
+    q.append(1, 'test-index', body='x')
+    q.append(2, 'test-index', body='x' * 500)
+    q.append(3, 'test-index', body='x')
+    q.release.set()
+    q.flush()
+
+    assert [('test-index', [1]), ('test-index', [2]), ('test-index', [3])] == q.sent
+
+def test_flush_sends_batches_concurrently_and_reports_them_in_order():
+    state = {'running': 0, 'max': 0}
+    lock = threading.Lock()
+
+    class SlowQueue(RecordingQueue):
+        def _ensure_thread(self):
+            # leave all the sending to flush()
+            pass
+
+        def _send(self, index, batch):
+            with lock:
+                state['running'] += 1
+                state['max'] = max(state['max'], state['running'])
+            time.sleep(0.05)
+            with lock:
+                state['running'] -= 1
+            if batch[0].document.id == 2:
+                raise ValueError('boom')
+            return [(True, {'index': {'status': 201}})] * len(batch)
+
+    q = SlowQueue(max_docs=1, flush_interval=60, concurrency=4)
+    for i in range(4):
+        q.append(i, 'test-index')
+
+    with raises(BulkError) as e:
+        q.flush()
+
+    assert 4 == state['max']
+    assert [2] == [r.items[0].document.id for r in e.value.errors]
+    assert 'boom' == str(e.value.errors[0].error)
+    q.close()
+
+def test_concurrent_batches_give_no_ordering_guarantee_for_repeated_ids():
+    release = threading.Event()
+
+    class SlowQueue(RecordingQueue):
+        def _ensure_thread(self):
+            pass
+
+        def _send(self, index, batch):
+            # the older write is held up until the newer one has landed
+            if batch[0].document.body == 'old':
+                release.wait(2.0)
+            self.sent.append(batch[0].document.body)
+            release.set()
+
+    q = SlowQueue(max_docs=1, flush_interval=60, concurrency=2)
+    q.append('a', 'test-index', 'old')
+    q.append('a', 'test-index', 'new')
+    q.flush()
+
+    assert ['new', 'old'] == q.sent
+
+def test_adaptive_controller_grows_additively_and_backs_off_on_rejections():
+    c = AdaptiveController(batch_size=100, min_batch_size=10, max_batch_size=120, batch_step=10,
+                           max_concurrency=3, target_latency=1.0)
+
+    c.record(100, 0.1, 0)
+    c.record(110, 0.1, 0)
+    assert (120, 1) == (c.batch_size, c.concurrency)
+    c.record(120, 0.1, 0)
+    c.record(120, 0.1, 0)
+    assert (120, 3) == (c.batch_size, c.concurrency)
+
+    # slow but accepted requests hold the current settings
+    c.record(120, 5.0, 0)
+    assert (120, 3) == (c.batch_size, c.concurrency)
+
+    c.record(120, 0.1, 12)
+    assert (60, 1) == (c.batch_size, c.concurrency)
+    assert 0 < c.settings()['rejection_rate']
+
+def test_adaptive_queue_follows_its_controller():
+    q = RecordingQueue(max_docs=50, concurrency=2, adaptive=True)
+
+    assert isinstance(q.controller, AdaptiveController)
+    assert (50, 2) == (q.max_docs, q.concurrency)
+    q.controller.record(50, 0.1, 50)
+    assert (25, 1) == (q.max_docs, q.concurrency)
+
+def test_packed_buffer_keeps_items_encoded_back_to_back():
+    buf = PackedBuffer()
+    items = [BulkItem(None, '{"index": {"_id": 1}}', '{"n": 1}'), BulkItem(None, '{"delete": {"_id": 2}}')]
+    buf.extend(items)
+
+    assert 2 == len(buf)
+    assert [i.size for i in items] == list(buf.sizes())
+    assert b'{"index": {"_id": 1}}\n{"n": 1}\n{"delete": {"_id": 2}}\n' == bytes(buf.data)
+
+    first = buf.take(1, items[0].size)
+    assert b'{"index": {"_id": 1}}\n{"n": 1}\n' == bytes(first.body)
+    assert [(b'{"index": {"_id": 1}}', b'{"n": 1}')] == [(i.action, i.source) for i in first]
+    assert [(b'{"delete": {"_id": 2}}', None)] == [(i.action, i.source) for i in buf.take(1, items[1].size)]
+    assert 0 == len(buf)
+
+def test_compact_queue_sends_its_buffer_as_the_request_body():
+    client = Mock()
+    client.transport.serializer = BufferSerializer()
+    client.transport.perform_request.return_value = 200, {
+        'items': [{'index': {'status': 201}}, {'index': {'status': 201}}]}
+    connections.add_connection('compact', client)
+    q = Queue(using='compact', max_docs=10, flush_interval=60, compact=True)
+    q.append(Doc(1, 'a'), 'test-index')
+    q.append(Doc(2, 'b'), 'test-index')
+
+    assert 2 == len(q._queue['test-index'])
+    buffer = q._queue['test-index'].data
+    q.flush()
+
+    (method, url), kwargs = client.transport.perform_request.call_args
+    assert ('POST', '/test-index/_bulk', {'timeout': '60'}) == (method, url, kwargs['params'])
+    # the buffer itself, not a copy, through the transport for its retries
+    body = kwargs['body']
+    assert body is buffer
+    assert not client.bulk.called
+    assert [{'index': {'_id': 1, '_type': 'doc', '_index': 'test-index'}}, {'body': 'a'},
+            {'index': {'_id': 2, '_type': 'doc', '_index': 'test-index'}}, {'body': 'b'}] == \
+        [json.loads(l.decode('utf-8')) for l in body.splitlines()]
+    q.close()
+
+def test_compact_queue_copies_its_buffer_for_other_serializers():
+    client = Mock()
+    client.transport.serializer = JSONSerializer()
+    client.bulk.return_value = {'items': [{'index': {'status': 201}}]}
+    connections.add_connection('compact', client)
+    q = Queue(using='compact', max_docs=10, flush_interval=60, compact=True)
+    q.append(Doc(1, 'a'), 'test-index')
+    q.flush()
+
+    body = client.bulk.call_args[0][0]
+    assert isinstance(body, bytes) and {'body': 'a'} == json.loads(body.splitlines()[1].decode('utf-8'))
+    assert not client.transport.perform_request.called
+    q.close()
+
+def test_coalescing_queue_keeps_the_latest_version_of_each_document():
+    q = RecordingQueue(max_docs=10, flush_interval=60, coalesce=True)
+    q.append(1, 'test-index', body='first')
+    q.append(2, 'test-index')
+    q.append(1, 'test-index', body='second')
+    assert 2 == len(q)
+    batch = q._queue['test-index']
+    assert [{'body': 'second'}, {'body': ''}] == [json.loads(item.source) for item in batch]
+    assert q._bytes['test-index'] == sum(item.size for item in batch)
+
+    q.flush()
+    q.append(1, 'test-index', body='third')
+    q.flush()
+    assert [('test-index', [1, 2]), ('test-index', [1])] == q.sent
+
+def test_coalescing_queue_merges_partial_updates():
+    q = RecordingQueue(max_docs=10, flush_interval=60, coalesce=True)
+    q.append_encoded('{"index":{"_id":1}}', '{"a":1,"o":{"x":1}}', 'i')
+    q.append_encoded('{"update":{"_id":1}}', '{"doc":{"o":{"y":2}}}', 'i')
+    q.append_encoded('{"update":{"_id":2}}', '{"doc":{"a":1}}', 'i')
+    q.append_encoded('{"update":{"_id":2}}', '{"doc":{"b":2},"doc_as_upsert":true}', 'i')
+    q.append_encoded('{"update":{"_id":2}}', '{"script":"ctx._source.a += 1"}', 'i')
+    q.append_encoded('{"update":{"_id":2}}', '{"doc":{"c":3}}', 'i')
+    q.append_encoded('{"delete":{"_id":3}}', None, 'i')
+    q.append_encoded('{"create":{"_id":3}}', '{"a":1}', 'i')
+    q.append_encoded('{"index":{"_id":4}}', '{"a":1}', 'i')
+    q.append_encoded('{"index":{"_id":4}}', '{"a":2}', 'i')
+    q.append_encoded('{"create":{"_id":4}}', '{"a":3}', 'i')
+
+    # only merged where the outcome is the same as writing both in order
+    assert [
+        ({'index': {'_id': 1}}, {'a': 1, 'o': {'x': 1, 'y': 2}}),
+        ({'update': {'_id': 2}}, {'doc': {'a': 1}}),
+        ({'update': {'_id': 2}}, {'doc': {'b': 2}, 'doc_as_upsert': True}),
+        ({'update': {'_id': 2}}, {'script': 'ctx._source.a += 1'}),
+        ({'update': {'_id': 2}}, {'doc': {'c': 3}}),
+        ({'index': {'_id': 3}}, {'a': 1}),
+        ({'index': {'_id': 4}}, {'a': 2}),
+        ({'create': {'_id': 4}}, {'a': 3}),
+    ] == [(json.loads(item.action), json.loads(item.source) if item.source else None) for item in q._queue['i']]
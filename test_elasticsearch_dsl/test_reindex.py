@@ -0,0 +1,90 @@
+import json
+
+from elasticsearch.serializer import JSONSerializer
+from mock import Mock, call
+
+from elasticsearch_dsl.connections import connections
+from elasticsearch_dsl.reindex import reindex
+from elasticsearch_dsl.search import Search
+
+
+def _client(shards):
+    """
+    Client for ``old`` with one page of hits per shard, ``shards`` being
+    the ``_id`` of the hits in every shard.
+    """
+    client = Mock()
+    client.transport.serializer = JSONSerializer()
+    client.search_shards.return_value = {'shards': [[{'index': 'old', 'shard': n}] for n in range(len(shards))]}
+    pages = dict(('_shards:%d' % n, [ids, []]) for n, ids in enumerate(shards))
+    client.search.side_effect = lambda **kwargs: {'_scroll_id': kwargs['preference']}
+
+    def scroll(scroll_id, scroll):
+        hits = [{'_id': i, '_type': 'post', '_source': {'n': i}} for i in pages[scroll_id].pop(0)]
+        return {'_scroll_id': scroll_id, '_shards': {'failed': 0}, 'hits': {'hits': hits}}
+    client.scroll.side_effect = scroll
+
+    client.bulked = []
+    client.rejected = set()
+    def bulk(body, **kwargs):
+        lines = [json.loads(l) for l in body.splitlines()]
+        client.bulked.extend(zip(lines[::2], lines[1::2]))
+        return {'items': [{'index': {'status': 400, 'error': 'MapperParsingException'}}
+                          if action['index']['_id'] in client.rejected else {'index': {'status': 201}}
+                          for action in lines[::2]]}
+    client.bulk.side_effect = bulk
+
+    client.indices.get_settings.return_value = {'new-1': {'settings': {'index': {'number_of_replicas': '1'}}}}
+    client.indices.exists_alias.return_value = True
+    client.indices.get_alias.return_value = {'old': {'aliases': {'live': {}}}}
+    return client
+
+def test_reindex_copies_every_shard_and_swaps_the_alias():
+    client = _client([[1, 2], [3]])
+    connections.add_connection('reindex', client)
+    updates = []
+
+    stats = reindex(Search(using='reindex', index='old'), 'new',
+                    transform=lambda hit: hit if hit['_id'] != 2 else None,
+                    batch_size=1, progress=updates.append, fast=True, alias='live')
+
+    assert {'read': 3, 'written': 2, 'failed': 0, 'skipped': 1, 'shards': 2} == stats
+    assert [({'index': {'_index': 'new', '_type': 'post', '_id': 1}}, {'n': 1}),
+            ({'index': {'_index': 'new', '_type': 'post', '_id': 3}}, {'n': 3})] == \
+        sorted(client.bulked, key=lambda line: line[1]['n'])
+    assert 2 == len(updates)
+    assert set([1]) == set(kwargs['size'] for _, kwargs in client.search.call_args_list)
+    assert [call(index='new', body={'index': {'refresh_interval': '-1', 'number_of_replicas': 0}}),
+            call(index='new', body={'index': {'refresh_interval': '1s', 'number_of_replicas': '1'}})] == \
+        client.indices.put_settings.call_args_list
+    client.indices.update_aliases.assert_called_once_with(body={'actions': [
+        {'remove': {'index': 'old', 'alias': 'live'}}, {'add': {'index': 'new', 'alias': 'live'}}]})
+
+def test_reindex_skips_shards_recorded_in_the_checkpoint(tmpdir):
+    checkpoint = str(tmpdir.join('checkpoint.json'))
+    with open(checkpoint, 'w') as f:
+        json.dump({'shards': [0]}, f)
+    client = _client([[1, 2], [3]])
+    connections.add_connection('reindex', client)
+
+    stats = reindex(Search(using='reindex', index='old'), 'new', checkpoint=checkpoint)
+
+    assert [3] == [action['index']['_id'] for action, _ in client.bulked]
+    assert 2 == stats['shards']
+    with open(checkpoint) as f:
+        assert {'shards': [0, 1]} == json.load(f)
+
+def test_reindex_counts_rejected_documents_and_checkpoints_complete_shards(tmpdir):
+    checkpoint = str(tmpdir.join('checkpoint.json'))
+    client = _client([[1, 2], [3], [4]])
+    client.rejected.add(2)
+    connections.add_connection('reindex', client)
+
+    stats = reindex(Search(using='reindex', index='old'), 'new', readers=1, batch_size=1,
+                    checkpoint=checkpoint, alias='live')
+
+    assert {'read': 4, 'written': 3, 'failed': 1, 'skipped': 0, 'shards': 2} == stats
+    with open(checkpoint) as f:
+        assert {'shards': [1, 2]} == json.load(f)
+    # not everything made it
+    assert not client.indices.update_aliases.called
@@ -306,6 +306,18 @@ def test_params_being_passed_to_search(mock_client):
         routing='42'
     )
 
+def test_search_routes_on_routing_field_restricted_by_term_filters():
+    s = search.Search(routing_field='tenant_id')
+
+    assert {} == s._request_params()
+    assert {'routing': 'acme'} == s.filter('term', tenant_id='acme')._request_params()
+    assert {'routing': 'acme,globex'} == \
+        s.query('match', title='python').filter('terms', tenant_id=['acme', 'globex'])._request_params()
+    assert {'routing': 'acme'} == s.query('bool', must=[Q('term', tenant_id='acme')])._request_params()
+    # only a clause every hit has to match restricts the shards
+    assert {} == s.query('bool', should=[Q('term', tenant_id='acme')])._request_params()
+    assert {'routing': 'other'} == s.filter('term', tenant_id='acme').params(routing='other')._request_params()
+
 def test_fields():
     assert {
         'query': {
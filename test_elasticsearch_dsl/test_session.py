@@ -0,0 +1,134 @@
+import json
+
+from elasticsearch.serializer import JSONSerializer
+from mock import Mock
+from pytest import raises
+
+from elasticsearch_dsl.connections import connections
+from elasticsearch_dsl.document import Document
+from elasticsearch_dsl.exceptions import BulkError
+from elasticsearch_dsl.fields import StringField
+from elasticsearch_dsl.session import Session, current_session
+
+
+class Order(Document):
+    customer = StringField()
+
+    meta = {
+        'index': 'orders',
+        'using': 'session',
+    }
+
+
+class LineItem(Document):
+    product = StringField()
+
+    meta = {
+        'index': 'line-items',
+        'using': 'session',
+    }
+
+
+def _client(*items):
+    client = Mock()
+    client.transport.serializer = JSONSerializer()
+    client.bulk.return_value = {'items': list(items)}
+    connections.add_connection('session', client)
+    return client
+
+def test_session_sends_writes_of_all_classes_in_one_request_in_order():
+    client = _client(
+        {'index': {'_index': 'orders', '_type': 'order', '_id': 'o1', '_version': 1, 'status': 201}},
+        {'index': {'_index': 'line-items', '_type': 'line_item', '_id': 'l1', '_version': 1, 'status': 201}},
+        {'delete': {'_index': 'line-items', '_type': 'line_item', '_id': 'l0', 'status': 200}},
+    )
+    order, item, old = Order(customer='Jane'), LineItem(product='Book'), LineItem(id='l0', product='Pen')
+
+    with Session() as session:
+        assert session is current_session()
+        order.save()
+        item.save()
+        old.delete()
+        assert 3 == len(session)
+        assert not client.bulk.called
+
+    assert current_session() is None
+    assert 1 == client.bulk.call_count
+    lines = [json.loads(l) for l in client.bulk.call_args[0][0].splitlines()]
+    assert [{'index': {'_index': 'orders', '_type': 'order'}}, {'customer': 'Jane'},
+            {'index': {'_index': 'line-items', '_type': 'line_item'}}, {'product': 'Book'},
+            {'delete': {'_index': 'line-items', '_type': 'line_item', '_id': 'l0'}}] == lines
+    assert ('o1', 1, 201) == (order.id, order._meta.version, order._status)
+    assert 'l1' == item.id
+
+def test_session_reports_failed_documents_and_sends_nothing_on_error():
+    client = _client({'index': {'_id': '1', 'status': 400, 'error': 'MapperParsingException'}})
+    order = Order(id='1', customer='Jane')
+
+    with raises(ValueError):
+        with Session():
+            order.save()
+            raise ValueError()
+    assert not client.bulk.called
+
+    with raises(BulkError):
+        with Session():
+            order.save()
+    assert 'MapperParsingException' == order._error
+
+def test_session_splits_requests_by_max_docs_and_max_bytes():
+    client = _client()
+    client.bulk.side_effect = lambda body, **kwargs: {'items': [
+        {'index': {'_id': json.loads(l)['customer'], 'status': 201}} for l in body.splitlines()[1::2]]}
+    orders = [Order(customer=name) for name in ('a', 'b', 'c', 'd' * 200, 'e')]
+
+    with Session(max_docs=2, max_bytes=200):
+        for order in orders:
+            order.save()
+
+    assert [['a', 'b'], ['c'], ['d' * 200], ['e']] == [
+        [json.loads(l)['customer'] for l in args[0].splitlines()[1::2]] for args, _ in client.bulk.call_args_list]
+    assert ['a', 'b', 'c', 'd' * 200, 'e'] == [order.id for order in orders]
+
+class Invoice(Document):
+    customer = StringField()
+
+    meta = {
+        'index': 'invoices',
+        'using': 'session-invoices',
+    }
+
+def test_session_sends_interleaved_connections_in_recording_order():
+    sent = []
+    for using in ('session', 'session-invoices'):
+        client = Mock()
+        client.transport.serializer = JSONSerializer()
+        client.bulk.side_effect = lambda body, using=using, **kwargs: sent.append(
+            (using, [json.loads(l)['customer'] for l in body.splitlines()[1::2]])) or {'items': [
+            {'index': {'_id': '1', 'status': 201}} for l in body.splitlines()[1::2]]}
+        connections.add_connection(using, client)
+
+    with Session():
+        Order(customer='a').save()
+        Invoice(customer='b').save()
+        Order(customer='c').save()
+
+    assert [('session', ['a']), ('session-invoices', ['b']), ('session', ['c'])] == sent
+
+def test_session_stops_at_the_first_rejected_write():
+    client = _client()
+    client.bulk.side_effect = [
+        {'items': [{'index': {'_id': 'a', 'status': 201}}, {'index': {'_id': 'b', 'status': 429}}]},
+        {'items': [{'index': {'_id': 'c', 'status': 201}}]},
+    ]
+    orders = [Order(customer=name) for name in 'abc']
+
+    with raises(BulkError) as e:
+        with Session(max_docs=2):
+            for order in orders:
+                order.save()
+
+    assert 1 == client.bulk.call_count
+    assert [201, 429, None] == [order._status for order in orders]
+    assert 'Session commit stopped at a rejected write.' == orders[2]._error
+    assert 2 == len(e.value.args[1])
@@ -0,0 +1,132 @@
+import os
+import time
+
+from pytest import raises
+
+from elasticsearch_dsl import queue
+from elasticsearch_dsl.exceptions import BulkError
+from elasticsearch_dsl.spill import SegmentLog
+
+from .test_queue import RecordingQueue, _wait_for
+
+
+def _segments(path):
+    return sorted(os.listdir(str(path)))
+
+def test_records_are_read_back_in_order_across_segments(tmpdir):
+    log = SegmentLog(str(tmpdir), segment_bytes=100)
+    for i in range(5):
+        log.append('i', '{"index": {"_id": %d}}' % i, '{"n": %d}' % i)
+
+    assert 5 == len(log)
+    assert len(_segments(tmpdir)) > 1
+    records = log.read(10 ** 6)
+    assert [{'index': {'_id': i}} for i in range(5)] == [r[2] for r in records]
+    assert [{'n': i} for i in range(5)] == [r[3] for r in records]
+    assert 0 == len(log)
+
+def test_segments_are_deleted_once_read_and_acknowledged(tmpdir):
+    log = SegmentLog(str(tmpdir), segment_bytes=1)
+    log.append('i', '{"delete": {"_id": 1}}')
+    log.append('i', '{"delete": {"_id": 2}}')
+    first, second = log.read(1)[0], log.read(1)[0]
+
+    assert 2 == len(_segments(tmpdir))
+    log.ack(first[0])
+    # the second segment is still being written to
+    assert [os.path.basename(log._file(second[0]))] == _segments(tmpdir)
+    assert None is second[3]
+
+def test_unacknowledged_records_are_replayed_after_restart(tmpdir):
+    log = SegmentLog(str(tmpdir), fsync_every=1)
+    log.append('i', '{"index": {}}', '{"n": 1}')
+    log.append('i', '{"index": {}}', '{"n": 2}')
+    log.read(1)
+    log.close()
+    with open(log._file(0), 'ab') as f:
+        f.write(b'{"index": "i", "act')
+
+    log = SegmentLog(str(tmpdir))
+    assert 2 == len(log)
+    assert [{'n': 1}, {'n': 2}] == [r[3] for r in log.read(10 ** 6)]
+
+def test_queue_spills_to_disk_past_threshold_and_sends_everything(tmpdir):
+    q = RecordingQueue(max_docs=2, flush_interval=60, spill_dir=str(tmpdir), spill_threshold=150)
+    q.release.clear()
+    for i in range(6):
+        q.append(i, 'test-index', body='x' * 40)
+
+    assert 6 == len(q)
+    assert q._memory <= 150
+    assert len(q._log)
+    q.release.set()
+    q.flush()
+
+    assert list(range(6)) == sorted(i for _, batch in q.sent for i in batch)
+    assert 0 == len(q)
+    q.close()
+    assert [] == _segments(tmpdir)
+
+def test_queue_replays_spilled_items_left_by_previous_process(tmpdir):
+    log = SegmentLog(str(tmpdir))
+    log.append('test-index', '{"index": {"_id": 7}}', '{"body": ""}')
+    log.close()
+
+    q = RecordingQueue(max_docs=10, flush_interval=60, spill_dir=str(tmpdir))
+    # replayed items are overdue, the background thread sends them right away
+    assert _wait_for(lambda: q.sent)
+    assert [('test-index', [7])] == q.sent
+
+def test_replayed_batch_failing_as_a_whole_is_retried_with_backoff(tmpdir, monkeypatch):
+    monkeypatch.setattr(queue, '_backoff', lambda attempt, initial, maximum: 30)
+    log = SegmentLog(str(tmpdir))
+    log.append('test-index', '{"index": {"_id": 7}}', '{"body": ""}')
+    log.close()
+
+    class DownQueue(RecordingQueue):
+        def _send(self, index, batch):
+            super(DownQueue, self)._send(index, batch)
+            if len(self.sent) == 1:
+                raise ValueError('cluster is down')
+
+    q = DownQueue(max_docs=10, flush_interval=60, spill_dir=str(tmpdir))
+    assert _wait_for(lambda: q._retry)
+    time.sleep(0.1)
+    # kept, but not sent again before its backoff is over
+    assert 1 == len(q.sent)
+    assert 1 == len(q)
+
+    q.close()
+    assert [('test-index', [7]), ('test-index', [7])] == q.sent
+    assert {} == q._retry
+    assert [] == _segments(tmpdir)
+
+def test_failed_batch_is_kept_whole_when_partly_in_memory_and_partly_spilled(tmpdir, monkeypatch):
+    monkeypatch.setattr(queue, '_backoff', lambda attempt, initial, maximum: 30)
+
+    class DownQueue(RecordingQueue):
+        def _ensure_thread(self):
+            # leave all the sending to flush()
+            pass
+
+        def _send(self, index, batch):
+            super(DownQueue, self)._send(index, batch)
+            if len(self.sent) == 1:
+                raise ValueError('cluster is down')
+
+    q = DownQueue(max_docs=10, flush_interval=60, spill_dir=str(tmpdir), spill_threshold=200)
+    for i in range(3):
+        q.append(i, 'test-index', body='x' * 40)
+    # 0 is held in memory, 1 and 2 are on disk
+    assert 2 == len(q._log)
+
+    with raises(BulkError):
+        q.flush()
+    # 0 from memory and 1 read back from disk
+    assert [('test-index', [0, 1])] == q.sent
+    assert 3 == len(q)
+
+    q.close()
+    assert [0, 1, 2] == [i for _, batch in q.sent[1:] for i in batch]
+    assert 0 == len(q)
+    assert [] == _segments(tmpdir)
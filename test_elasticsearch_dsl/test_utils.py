@@ -1,3 +1,8 @@
+from elasticsearch import ConnectionError, TransportError
+from elasticsearch.serializer import JSONSerializer
+from mock import Mock
+from pytest import raises
+
 from elasticsearch_dsl import utils
 
 def test_attrdict_bool():
@@ -14,3 +19,57 @@ def test_attrlist_items_get_wrapped_during_iteration():
 
     assert isinstance(l[2], utils.AttrList)
     assert isinstance(l[3], utils.AttrDict)
+
+def _bulk_client(*responses):
+    client = Mock()
+    client.transport.serializer = JSONSerializer()
+    client.bulk.side_effect = list(responses)
+    return client
+
+def test_bulk_only_resends_items_rejected_with_retryable_status():
+    client = _bulk_client(
+        {'items': [
+            {'index': {'_id': '1', 'status': 201}},
+            {'index': {'_id': '2', 'status': 429, 'error': 'EsRejectedExecutionException'}},
+            {'index': {'_id': '3', 'status': 400, 'error': 'MapperParsingException'}},
+        ]},
+        {'items': [{'index': {'_id': '2', 'status': 201}}]},
+    )
+    actions = [{'_id': str(i), '_source': {'i': i}} for i in range(1, 4)]
+
+    results = utils._bulk(client, 'i', actions, timeout=60, initial_backoff=0)
+
+    assert [True, True, False] == [ok for ok, _ in results]
+    assert 'MapperParsingException' == results[2][1]['index']['error']
+    assert 2 == client.bulk.call_count
+    resent = client.bulk.call_args[0][0]
+    assert '{"index": {"_id": "2"}}\n{"i": 2}\n' == resent
+
+def test_bulk_reports_items_still_rejected_after_max_retries():
+    rejected = {'index': {'_id': '1', 'status': 503}}
+    client = _bulk_client(*({'items': [dict(rejected)]} for _ in range(3)))
+
+    results = utils._bulk(client, 'i', [{'_id': '1', 'x': 1}], timeout=60, max_retries=2, initial_backoff=0)
+
+    assert 3 == client.bulk.call_count
+    assert [(False, rejected)] == results
+
+def test_bulk_retries_whole_request_on_connection_error_only():
+    client = _bulk_client(ConnectionError('N/A', 'boom', None), {'items': [{'index': {'status': 200}}]})
+    assert [True] == [ok for ok, _ in utils._bulk(client, 'i', [{'x': 1}], timeout=60, initial_backoff=0)]
+
+    client = _bulk_client(TransportError(400, 'bad request', None))
+    with raises(TransportError):
+        utils._bulk(client, 'i', [{'x': 1}], timeout=60, initial_backoff=0)
+    assert 1 == client.bulk.call_count
+
+def test_bulk_reports_every_request_to_on_response():
+    client = _bulk_client(
+        {'items': [{'index': {'status': 201}}, {'index': {'status': 429}}]},
+        {'items': [{'index': {'status': 201}}]},
+    )
+    calls = []
+    utils._bulk(client, 'i', [{'x': 1}, {'x': 2}], timeout=60, initial_backoff=0,
+                on_response=lambda docs, latency, rejected: calls.append((docs, rejected)))
+
+    assert [(2, 1), (1, 0)] == calls